@@ -1,6 +1,10 @@
 import os
+import threading
+from contextlib import contextmanager
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
+import psycopg2.pool
 from urllib.parse import urlparse
 
 
@@ -17,112 +21,232 @@ if not DATABASE_URL:
 
 
 # ============================================================
-# ✅ 2. Connection Utility
+# ✅ 2. NUMERIC → float
 # ============================================================
+# Amounts are NUMERIC(12,2); the settlement math decodes them straight to
+# float instead of Decimal so it doesn't need a float() per row. Registered
+# per cursor only, so other readers (e.g. the PDF report) keep Decimal.
+DEC2FLOAT = psycopg2.extensions.new_type(
+    psycopg2.extensions.DECIMAL.values,
+    "DEC2FLOAT",
+    lambda value, cur: float(value) if value is not None else None,
+)
+
+
+def float_cursor(cursor):
+    """Make this cursor decode NUMERIC columns as float; returns the cursor."""
+    psycopg2.extensions.register_type(DEC2FLOAT, cursor)
+    return cursor
+
+
+# ============================================================
+# ✅ 3. Connection Pool
+# ============================================================
+# DB_POOL_MIN is how many connections are actually kept open and reused:
+# psycopg2 closes any connection returned beyond it, so set it to the
+# expected number of concurrent requests. DB_POOL_MAX only caps bursts.
+# Sizes are per process; with several workers (or behind PgBouncer) keep
+# workers * DB_POOL_MAX under the server's connection limit.
+POOL_MIN_CONN = int(os.getenv("DB_POOL_MIN", "8"))
+POOL_MAX_CONN = int(os.getenv("DB_POOL_MAX", "20"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    """Create the shared pool on first use (not at import, so the app can boot without a DB)."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # Enable SSL for cloud platforms like Render; TCP keepalives
+                # stop idle pooled connections being dropped silently
+                _pool = psycopg2.pool.ThreadedConnectionPool(
+                    POOL_MIN_CONN, POOL_MAX_CONN, DATABASE_URL, sslmode="require",
+                    keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=5,
+                )
+    return _pool
+
+
 def get_connection():
-    """Create a PostgreSQL database connection with SSL if hosted."""
+    """
+    Borrow a PostgreSQL connection from the shared pool.
+    If the pool is exhausted, falls back to a dedicated connection.
+    Always hand it back with put_connection().
+    """
     try:
-        # Enable SSL for cloud platforms like Render
-        conn = psycopg2.connect(DATABASE_URL, sslmode="require")
-        return conn
+        try:
+            return _get_pool().getconn()
+        except psycopg2.pool.PoolError:
+            return psycopg2.connect(DATABASE_URL, sslmode="require")
     except Exception as e:
         print(f"❌ Database connection failed: {e}")
         raise RuntimeError("Unable to connect to the database")
 
 
+def put_connection(conn):
+    """Return a connection to the pool (open transactions are rolled back)."""
+    try:
+        _get_pool().putconn(conn)
+    except psycopg2.pool.PoolError:
+        # overflow connection, not owned by the pool
+        conn.close()
+
+
+@contextmanager
+def db(conn=None):
+    """
+    with db() as conn: ...
+    Borrows a connection and always returns it, rolling back first if the
+    block raised so a half-done transaction never goes back into the pool.
+    Pass an existing connection to reuse it; the caller keeps ownership.
+    """
+    if conn is not None:
+        yield conn
+        return
+
+    conn = get_connection()
+    try:
+        yield conn
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        put_connection(conn)
+
+
 # ============================================================
-# ✅ 3. Initialize All Tables (idempotent)
+# ✅ 4. Initialize All Tables (idempotent)
 # ============================================================
 def initialize_database():
-    conn = get_connection()
-    cur = conn.cursor()
-
-    # ✅ Trips Table
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS trips (
-        id SERIAL PRIMARY KEY,
-        name TEXT NOT NULL,
-        start_date TEXT,
-        trip_type TEXT,
-        mode TEXT DEFAULT 'TRIP',              -- 🆕 Trip/Stay mode
-        billing_cycle TEXT,                    -- 🆕 For STAY (optional)
-        access_code TEXT UNIQUE,
-        status TEXT DEFAULT 'ACTIVE',
-        owner_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-        owner_name TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    """)
-
-    # ✅ Family Details Table
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS family_details (
-        id SERIAL PRIMARY KEY,
-        trip_id INTEGER REFERENCES trips(id) ON DELETE CASCADE,
-        family_name TEXT NOT NULL,
-        members_count INTEGER NOT NULL DEFAULT 0,
-        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    """)
-
-    # ✅ Expenses Table
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS expenses (
-        id SERIAL PRIMARY KEY,
-        trip_id INTEGER REFERENCES trips(id) ON DELETE CASCADE,
-        payer_family_id INTEGER REFERENCES family_details(id) ON DELETE SET NULL,
-        expense_name TEXT NOT NULL,
-        amount NUMERIC(12,2) NOT NULL DEFAULT 0,
-        date TEXT,
-        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    """)
-
-    # ✅ Advances Table
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS advances (
-        id SERIAL PRIMARY KEY,
-        trip_id INTEGER REFERENCES trips(id) ON DELETE CASCADE,
-        payer_family_id INTEGER REFERENCES family_details(id) ON DELETE CASCADE,
-        receiver_family_id INTEGER REFERENCES family_details(id) ON DELETE CASCADE,
-        amount NUMERIC(12,2) NOT NULL,
-        date TEXT,
-        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    """)
-        # ✅ Stay Settlements Table
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS stay_settlements (
-        id SERIAL PRIMARY KEY,
-        trip_id INTEGER REFERENCES trips(id) ON DELETE CASCADE,
-        mode TEXT DEFAULT 'STAY',
-        period_start DATE,
-        period_end DATE,
-        total_expense NUMERIC(12,2),
-        per_head_cost NUMERIC(12,2),
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    """)
-
-    # ✅ Stay Settlement Details Table
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS stay_settlement_details (
-        id SERIAL PRIMARY KEY,
-        settlement_id INTEGER REFERENCES stay_settlements(id) ON DELETE CASCADE,
-        family_id INTEGER REFERENCES family_details(id) ON DELETE CASCADE,
-        family_name TEXT,
-        members_count INTEGER,
-        total_spent NUMERIC(12,2),
-        due_amount NUMERIC(12,2),
-        balance NUMERIC(12,2)
-    );
-    """)
+    with db() as conn:
+        cur = conn.cursor()
 
-    
-    conn.commit()
-    cur.close()
-    conn.close()
+        # ✅ Trips Table
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS trips (
+            id SERIAL PRIMARY KEY,
+            name TEXT NOT NULL,
+            start_date TEXT,
+            trip_type TEXT,
+            mode TEXT DEFAULT 'TRIP',              -- 🆕 Trip/Stay mode
+            billing_cycle TEXT,                    -- 🆕 For STAY (optional)
+            access_code TEXT UNIQUE,
+            status TEXT DEFAULT 'ACTIVE',
+            owner_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+            owner_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """)
+
+        # ✅ Family Details Table
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS family_details (
+            id SERIAL PRIMARY KEY,
+            trip_id INTEGER REFERENCES trips(id) ON DELETE CASCADE,
+            family_name TEXT NOT NULL,
+            members_count INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """)
+
+        # ✅ Expenses Table
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS expenses (
+            id SERIAL PRIMARY KEY,
+            trip_id INTEGER REFERENCES trips(id) ON DELETE CASCADE,
+            payer_family_id INTEGER REFERENCES family_details(id) ON DELETE SET NULL,
+            expense_name TEXT NOT NULL,
+            amount NUMERIC(12,2) NOT NULL DEFAULT 0,
+            date TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """)
+
+        # ✅ Advances Table
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS advances (
+            id SERIAL PRIMARY KEY,
+            trip_id INTEGER REFERENCES trips(id) ON DELETE CASCADE,
+            payer_family_id INTEGER REFERENCES family_details(id) ON DELETE CASCADE,
+            receiver_family_id INTEGER REFERENCES family_details(id) ON DELETE CASCADE,
+            amount NUMERIC(12,2) NOT NULL,
+            date TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """)
+            # ✅ Stay Settlements Table
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS stay_settlements (
+            id SERIAL PRIMARY KEY,
+            trip_id INTEGER REFERENCES trips(id) ON DELETE CASCADE,
+            mode TEXT DEFAULT 'STAY',
+            period_start DATE,
+            period_end DATE,
+            total_expense NUMERIC(12,2),
+            per_head_cost NUMERIC(12,2),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """)
+
+        # ✅ Stay Settlement Details Table
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS stay_settlement_details (
+            id SERIAL PRIMARY KEY,
+            settlement_id INTEGER REFERENCES stay_settlements(id) ON DELETE CASCADE,
+            family_id INTEGER REFERENCES family_details(id) ON DELETE CASCADE,
+            family_name TEXT,
+            members_count INTEGER,
+            total_spent NUMERIC(12,2),
+            due_amount NUMERIC(12,2),
+            balance NUMERIC(12,2)
+        );
+        """)
+
+        # ✅ Indexes for settlement lookups
+        # expenses: per-family SUM(amount) becomes an index-only scan
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_expenses_trip_payer
+            ON expenses (trip_id, payer_family_id) INCLUDE (amount, date);
+        """)
+        # advances: payer/receiver nets per trip read from the index alone
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_advances_trip
+            ON advances (trip_id) INCLUDE (payer_family_id, receiver_family_id, amount);
+        """)
+        # stay_settlements: "latest settlement for trip" is a single index fetch
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_stay_settlements_trip_id_desc
+            ON stay_settlements (trip_id, id DESC);
+        """)
+        # stay_settlement_details: carry-forward map of a settlement
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_stay_settlement_details_settlement
+            ON stay_settlement_details (settlement_id, family_id);
+        """)
+        # settlement_transactions: every settlement view filters by trip;
+        # the archive is read per (trip, last settlement) for the STAY view
+        # (tables are created outside this function, so only index them once they exist)
+        cur.execute("""
+        DO $$
+        BEGIN
+            IF to_regclass('settlement_transactions') IS NOT NULL THEN
+                CREATE INDEX IF NOT EXISTS idx_settlement_transactions_trip
+                    ON settlement_transactions (trip_id);
+            END IF;
+            IF to_regclass('settlement_transactions_archive') IS NOT NULL THEN
+                CREATE INDEX IF NOT EXISTS idx_settlement_transactions_archive_trip_settlement
+                    ON settlement_transactions_archive (trip_id, settlement_id);
+            END IF;
+        END $$;
+        """)
+
+
+        conn.commit()
+        cur.close()
 
     
 
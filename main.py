@@ -1,4 +1,5 @@
 import json
+import logging
 import os
 import traceback
 from fastapi import FastAPI, HTTPException, Request
@@ -9,18 +10,17 @@ from datetime import datetime
 import time
 from services.settlement import calculate_stay_settlement, get_settlement, record_stay_settlement, record_trip_settlement
 # Local imports
-from database import get_connection, initialize_database
+from database import db, get_connection, put_connection, initialize_database
 from models import (
     TripIn, FamilyIn, ExpenseIn,
     FamilyUpdate, ExpenseUpdate, AdvanceModel, UserIn
 )
 from services import trips, families, expenses, advances, settlement
 from io import BytesIO
-import os
 import sys
 # main.py
-from fastapi import FastAPI, BackgroundTasks
-from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from fastapi import BackgroundTasks
+from fastapi.responses import StreamingResponse
 from services.reports import  generate_settlement_pdf, share_pdf_via_whatsapp
 
 
@@ -37,6 +37,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 IS_DEV = os.environ.get("ENV", "development") == "development"
+
+# Service modules log through `logging`; the level comes from LOG_LEVEL
+# (not ENV, which defaults to development), so debug detail such as
+# per-family breakdowns is only formatted when asked for explicitly
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+logging.basicConfig(level=LOG_LEVEL, format="%(levelname)s %(name)s %(message)s")
+log = logging.getLogger("main")
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
     """
@@ -118,37 +125,36 @@ async def login_user(request: Request):
     if not phone and not email:
         raise HTTPException(status_code=400, detail="Provide either phone or email")
 
-    conn = get_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-
-    # ✅ Only check by provided field
-    if phone:
-        cursor.execute("""
-            SELECT id, name, phone, email, created_at
-            FROM users
-            WHERE phone = %s
-        """, (phone,))
-    else:
-        cursor.execute("""
-            SELECT id, name, phone, email, created_at
-            FROM users
-            WHERE email = %s
-        """, (email,))
+    with db() as conn:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
-    user = cursor.fetchone()
+        # ✅ Only check by provided field
+        if phone:
+            cursor.execute("""
+                SELECT id, name, phone, email, created_at
+                FROM users
+                WHERE phone = %s
+            """, (phone,))
+        else:
+            cursor.execute("""
+                SELECT id, name, phone, email, created_at
+                FROM users
+                WHERE email = %s
+            """, (email,))
 
-    # 🟩 Auto-register if not found
-    if not user:
-        cursor.execute("""
-            INSERT INTO users (name, phone, email)
-            VALUES (%s, %s, %s)
-            RETURNING id, name, phone, email, created_at
-        """, (name, phone, email))
         user = cursor.fetchone()
-        conn.commit()
 
-    cursor.close()
-    conn.close()
+        # 🟩 Auto-register if not found
+        if not user:
+            cursor.execute("""
+                INSERT INTO users (name, phone, email)
+                VALUES (%s, %s, %s)
+                RETURNING id, name, phone, email, created_at
+            """, (name, phone, email))
+            user = cursor.fetchone()
+            conn.commit()
+
+        cursor.close()
 
     # Safe datetime serialization
     for k, v in user.items():
@@ -219,7 +225,7 @@ def register_user(user: dict):
         raise HTTPException(status_code=500, detail=f"Registration failed: {str(e)}")
     finally:
         cursor.close()
-        conn.close()
+        put_connection(conn)
 
 
 # ================================================
@@ -278,7 +284,7 @@ def add_trip(trip: TripIn):
         raise HTTPException(status_code=500, detail=f"Trip creation failed: {e}")
     finally:
         cursor.close()
-        conn.close()
+        put_connection(conn)
 
 
 
@@ -328,7 +334,7 @@ def join_trip(access_code: str, user_id: int):
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         cursor.close()
-        conn.close()
+        put_connection(conn)
 
 
 @app.get("/trips/{user_id}")
@@ -348,17 +354,16 @@ def get_trips_for_user_endpoint(user_id: int):
 @app.get("/trip/{trip_id}")
 def get_trip(trip_id: int):
     """Fetch single trip with owner info."""
-    conn = get_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    cursor.execute("""
-        SELECT t.*, u.name AS owner_name
-        FROM trips t
-        LEFT JOIN users u ON t.owner_id = u.id
-        WHERE t.id = %s
-    """, (trip_id,))
-    trip = cursor.fetchone()
-    cursor.close()
-    conn.close()
+    with db() as conn:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor.execute("""
+            SELECT t.*, u.name AS owner_name
+            FROM trips t
+            LEFT JOIN users u ON t.owner_id = u.id
+            WHERE t.id = %s
+        """, (trip_id,))
+        trip = cursor.fetchone()
+        cursor.close()
 
     if not trip:
         raise HTTPException(status_code=404, detail="Trip not found")
@@ -483,21 +488,20 @@ def list_stay_settlements(trip_id: int):
     """
     List all recorded settlements for a given Stay trip.
     """
-    conn = get_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    with db() as conn:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
-    cursor.execute("""
-        SELECT id, trip_id, period_start AS start_date, period_end AS end_date,
-               total_expense, per_head_cost, created_at
-        FROM stay_settlements
-        WHERE trip_id = %s
-        ORDER BY id DESC
-    """, (trip_id,))
+        cursor.execute("""
+            SELECT id, trip_id, period_start AS start_date, period_end AS end_date,
+                   total_expense, per_head_cost, created_at
+            FROM stay_settlements
+            WHERE trip_id = %s
+            ORDER BY id DESC
+        """, (trip_id,))
 
-    records = cursor.fetchall()
+        records = cursor.fetchall()
 
-    cursor.close()
-    conn.close()
+        cursor.close()
 
     if not records:
         return {"message": f"No stay settlements found for trip_id {trip_id}"}
@@ -514,42 +518,40 @@ def get_stay_settlement_detail(settlement_id: int):
     Retrieve details for a specific recorded stay settlement.
     Includes settlement header and each family's contribution/balance.
     """
-    conn = get_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    with db() as conn:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+
+        # ✅ Settlement header
+        cursor.execute("""
+            SELECT s.id, s.trip_id, t.name AS trip_name, s.period_start, s.period_end,
+                   s.total_expense, s.per_head_cost, s.created_at
+            FROM stay_settlements s
+            JOIN trips t ON s.trip_id = t.id
+            WHERE s.id = %s
+        """, (settlement_id,))
+        settlement = cursor.fetchone()
+
+        if not settlement:
+            cursor.close()
+            return {"error": f"Settlement record {settlement_id} not found"}
+
+        # ✅ Family details
+        cursor.execute("""
+            SELECT 
+                d.family_id,
+                f.family_name,
+                d.members_count,
+                d.total_spent,
+                d.due_amount,
+                d.balance
+            FROM stay_settlement_details d
+            JOIN family_details f ON d.family_id = f.id
+            WHERE d.settlement_id = %s
+            ORDER BY f.family_name ASC
+        """, (settlement_id,))
+        details = cursor.fetchall()
 
-    # ✅ Settlement header
-    cursor.execute("""
-        SELECT s.id, s.trip_id, t.name AS trip_name, s.period_start, s.period_end,
-               s.total_expense, s.per_head_cost, s.created_at
-        FROM stay_settlements s
-        JOIN trips t ON s.trip_id = t.id
-        WHERE s.id = %s
-    """, (settlement_id,))
-    settlement = cursor.fetchone()
-
-    if not settlement:
         cursor.close()
-        conn.close()
-        return {"error": f"Settlement record {settlement_id} not found"}
-
-    # ✅ Family details
-    cursor.execute("""
-        SELECT 
-            d.family_id,
-            f.family_name,
-            d.members_count,
-            d.total_spent,
-            d.due_amount,
-            d.balance
-        FROM stay_settlement_details d
-        JOIN family_details f ON d.family_id = f.id
-        WHERE d.settlement_id = %s
-        ORDER BY f.family_name ASC
-    """, (settlement_id,))
-    details = cursor.fetchall()
-
-    cursor.close()
-    conn.close()
 
     settlement["details"] = details
     return settlement
@@ -559,25 +561,24 @@ def add_settlement_transaction(payload: dict):
     """
     Records an actual settlement transaction (money transfer).
     """
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        INSERT INTO settlement_transactions (
-            trip_id, from_family_id, to_family_id, amount, remarks
-        ) VALUES (%s, %s, %s, %s, %s)
-        RETURNING id;
-    """, (
-        payload["trip_id"],
-        payload["from_family_id"],
-        payload["to_family_id"],
-        payload["amount"],
-        payload.get("remarks")
-    ))
-
-    transaction_id = cursor.fetchone()[0]
-    conn.commit()
-    conn.close()
+    with db() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            INSERT INTO settlement_transactions (
+                trip_id, from_family_id, to_family_id, amount, remarks
+            ) VALUES (%s, %s, %s, %s, %s)
+            RETURNING id;
+        """, (
+            payload["trip_id"],
+            payload["from_family_id"],
+            payload["to_family_id"],
+            payload["amount"],
+            payload.get("remarks")
+        ))
+
+        transaction_id = cursor.fetchone()[0]
+        conn.commit()
 
     return {"message": "Transaction recorded successfully", "transaction_id": transaction_id}
 
@@ -586,51 +587,49 @@ def get_settlement_transactions(trip_id: int):
     """
     Returns all recorded settlement transactions for a given trip.
     """
-    conn = get_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    with db() as conn:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
-    cursor.execute("""
-        SELECT 
-            t.id,
-            t.trip_id,
-            t.amount,
-            t.transaction_date,
-            t.remarks,
-            f1.family_name AS from_family,
-            f2.family_name AS to_family
-        FROM settlement_transactions t
-        JOIN family_details f1 ON t.from_family_id = f1.id
-        JOIN family_details f2 ON t.to_family_id = f2.id
-        WHERE t.trip_id = %s
-        ORDER BY t.transaction_date DESC;
-    """, (trip_id,))
-
-    rows = cursor.fetchall()
-    conn.close()
+        cursor.execute("""
+            SELECT 
+                t.id,
+                t.trip_id,
+                t.amount,
+                t.transaction_date,
+                t.remarks,
+                f1.family_name AS from_family,
+                f2.family_name AS to_family
+            FROM settlement_transactions t
+            JOIN family_details f1 ON t.from_family_id = f1.id
+            JOIN family_details f2 ON t.to_family_id = f2.id
+            WHERE t.trip_id = %s
+            ORDER BY t.transaction_date DESC;
+        """, (trip_id,))
+
+        rows = cursor.fetchall()
     return {"trip_id": trip_id, "transactions": rows}
 
 @app.get("/settlement_transactions_archive/{trip_id}")
 def get_archived_transactions(trip_id: int):
-    conn = get_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    with db() as conn:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
-    cursor.execute("""
-        SELECT 
-            a.id,
-            a.amount,
-            a.transaction_date,
-            a.remarks,
-            f1.family_name AS from_family,
-            f2.family_name AS to_family,
-            a.archived_at
-        FROM settlement_transactions_archive a
-        JOIN family_details f1 ON a.from_family_id = f1.id
-        JOIN family_details f2 ON a.to_family_id = f2.id
-        WHERE a.trip_id = %s
-        ORDER BY a.archived_at DESC;
-    """, (trip_id,))
-    rows = cursor.fetchall()
-    conn.close()
+        cursor.execute("""
+            SELECT 
+                a.id,
+                a.amount,
+                a.transaction_date,
+                a.remarks,
+                f1.family_name AS from_family,
+                f2.family_name AS to_family,
+                a.archived_at
+            FROM settlement_transactions_archive a
+            JOIN family_details f1 ON a.from_family_id = f1.id
+            JOIN family_details f2 ON a.to_family_id = f2.id
+            WHERE a.trip_id = %s
+            ORDER BY a.archived_at DESC;
+        """, (trip_id,))
+        rows = cursor.fetchall()
     return {"trip_id": trip_id, "archived_transactions": rows}
 
 # ==========================================
@@ -643,19 +642,19 @@ def record_stay_settlement_endpoint(trip_id: int):
     Creates entries in stay_settlements and stay_settlement_details.
     """
     try:
-        print(f"🟢 Starting stay settlement recording for trip_id={trip_id}")
-        result = calculate_stay_settlement(trip_id)
-        print(f"✅ Calculation complete: total_expense={result['total_expense']}, per_head_cost={result['per_head_cost']}")
-        settlement_id = record_stay_settlement(trip_id, result)
-        print(f"💾 Recorded stay settlement with ID {settlement_id}")
+        log.debug("🟢 Starting stay settlement recording for trip_id=%s", trip_id)
+        # one pooled connection for calculate + finalize
+        with db() as conn:
+            result = calculate_stay_settlement(trip_id, conn=conn)
+            log.debug("✅ Calculation complete: total_expense=%s, per_head_cost=%s", result["total_expense"], result["per_head_cost"])
+            settlement_id = record_stay_settlement(trip_id, result, conn=conn)
+        log.debug("💾 Recorded stay settlement with ID %s", settlement_id)
         return {
             "message": f"Stay settlement recorded successfully for trip {trip_id}",
             "settlement_id": settlement_id
         }
     except Exception as e:
-        import traceback
-        print("❌ Error while recording stay settlement:", e)
-        traceback.print_exc()
+        log.exception("❌ Error while recording stay settlement: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to record stay settlement: {e}")
 # ==============================
 # Settlement Transaction Edit/Delete
@@ -663,62 +662,56 @@ def record_stay_settlement_endpoint(trip_id: int):
 
 @app.put("/update_settlement_transaction/{txn_id}")
 def update_settlement_transaction(txn_id: int, payload: dict):
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    # Check if transaction belongs to an unfinalized trip
-    cursor.execute("""
-        SELECT trip_id FROM settlement_transactions WHERE id = %s;
-    """, (txn_id,))
-    row = cursor.fetchone()
-    if not row:
-        conn.close()
-        return {"error": "Transaction not found."}
-
-    trip_id = row[0]
-    cursor.execute("SELECT COUNT(*) FROM stay_settlements WHERE trip_id = %s;", (trip_id,))
-    finalized = cursor.fetchone()[0] > 0
-    if finalized:
-        conn.close()
-        return {"error": "Settlement already finalized — editing not allowed."}
-
-    amount = int(round(float(payload.get("amount", 0))))
-    remarks = payload.get("remarks", "")
-    cursor.execute("""
-        UPDATE settlement_transactions
-        SET amount = %s, remarks = %s
-        WHERE id = %s;
-    """, (amount, remarks, txn_id))
-    conn.commit()
-    conn.close()
+    with db() as conn:
+        cursor = conn.cursor()
+
+        # Check if transaction belongs to an unfinalized trip
+        cursor.execute("""
+            SELECT trip_id FROM settlement_transactions WHERE id = %s;
+        """, (txn_id,))
+        row = cursor.fetchone()
+        if not row:
+            return {"error": "Transaction not found."}
+
+        trip_id = row[0]
+        cursor.execute("SELECT COUNT(*) FROM stay_settlements WHERE trip_id = %s;", (trip_id,))
+        finalized = cursor.fetchone()[0] > 0
+        if finalized:
+            return {"error": "Settlement already finalized — editing not allowed."}
+
+        amount = int(round(float(payload.get("amount", 0))))
+        remarks = payload.get("remarks", "")
+        cursor.execute("""
+            UPDATE settlement_transactions
+            SET amount = %s, remarks = %s
+            WHERE id = %s;
+        """, (amount, remarks, txn_id))
+        conn.commit()
 
     return {"message": "Transaction updated successfully."}
 
 
 @app.delete("/delete_settlement_transaction/{txn_id}")
 def delete_settlement_transaction(txn_id: int):
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    # Verify trip not finalized
-    cursor.execute("""
-        SELECT trip_id FROM settlement_transactions WHERE id = %s;
-    """, (txn_id,))
-    row = cursor.fetchone()
-    if not row:
-        conn.close()
-        return {"error": "Transaction not found."}
-
-    trip_id = row[0]
-    cursor.execute("SELECT COUNT(*) FROM stay_settlements WHERE trip_id = %s;", (trip_id,))
-    finalized = cursor.fetchone()[0] > 0
-    if finalized:
-        conn.close()
-        return {"error": "Settlement already finalized — deletion not allowed."}
-
-    cursor.execute("DELETE FROM settlement_transactions WHERE id = %s;", (txn_id,))
-    conn.commit()
-    conn.close()
+    with db() as conn:
+        cursor = conn.cursor()
+
+        # Verify trip not finalized
+        cursor.execute("""
+            SELECT trip_id FROM settlement_transactions WHERE id = %s;
+        """, (txn_id,))
+        row = cursor.fetchone()
+        if not row:
+            return {"error": "Transaction not found."}
+
+        trip_id = row[0]
+        cursor.execute("SELECT COUNT(*) FROM stay_settlements WHERE trip_id = %s;", (trip_id,))
+        finalized = cursor.fetchone()[0] > 0
+        if finalized:
+            return {"error": "Settlement already finalized — deletion not allowed."}
+
+        cursor.execute("DELETE FROM settlement_transactions WHERE id = %s;", (txn_id,))
+        conn.commit()
 
     return {"message": "Transaction deleted successfully."}
 
@@ -738,49 +731,48 @@ def get_carry_forward_log(trip_id: int, family_id: int = Query(None)):
     Includes trip name, stay period, and settlement dates.
     """
     try:
-        conn = get_connection()
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        with db() as conn:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+
+            base_query = """
+                SELECT 
+                    l.id,
+                    l.trip_id,
+                    t.name AS trip_name,
+                    ps.id AS previous_settlement_id,
+                    ps.period_start AS previous_period_start,
+                    ps.period_end AS previous_period_end,
+                    ps.created_at AS previous_settlement_date,
+                    ns.id AS new_settlement_id,
+                    ns.period_start AS new_period_start,
+                    ns.period_end AS new_period_end,
+                    ns.created_at AS new_settlement_date,
+                    l.family_id,
+                    f.family_name,
+                    l.previous_balance,
+                    l.new_balance,
+                    l.delta,
+                    l.created_at AS log_created_at
+                FROM stay_carry_forward_log l
+                JOIN family_details f ON l.family_id = f.id
+                JOIN trips t ON l.trip_id = t.id
+                LEFT JOIN stay_settlements ps ON l.previous_settlement_id = ps.id
+                LEFT JOIN stay_settlements ns ON l.new_settlement_id = ns.id
+                WHERE l.trip_id = %s
+            """
+
+            params = [trip_id]
 
-        base_query = """
-            SELECT 
-                l.id,
-                l.trip_id,
-                t.name AS trip_name,
-                ps.id AS previous_settlement_id,
-                ps.period_start AS previous_period_start,
-                ps.period_end AS previous_period_end,
-                ps.created_at AS previous_settlement_date,
-                ns.id AS new_settlement_id,
-                ns.period_start AS new_period_start,
-                ns.period_end AS new_period_end,
-                ns.created_at AS new_settlement_date,
-                l.family_id,
-                f.family_name,
-                l.previous_balance,
-                l.new_balance,
-                l.delta,
-                l.created_at AS log_created_at
-            FROM stay_carry_forward_log l
-            JOIN family_details f ON l.family_id = f.id
-            JOIN trips t ON l.trip_id = t.id
-            LEFT JOIN stay_settlements ps ON l.previous_settlement_id = ps.id
-            LEFT JOIN stay_settlements ns ON l.new_settlement_id = ns.id
-            WHERE l.trip_id = %s
-        """
-
-        params = [trip_id]
+            if family_id:
+                base_query += " AND l.family_id = %s"
+                params.append(family_id)
 
-        if family_id:
-            base_query += " AND l.family_id = %s"
-            params.append(family_id)
+            base_query += " ORDER BY l.created_at DESC;"
 
-        base_query += " ORDER BY l.created_at DESC;"
+            log.debug("📘 Fetching carry-forward logs for trip=%s, family=%s", trip_id, family_id or "ALL")
 
-        print(f"📘 Fetching carry-forward logs for trip={trip_id}, family={family_id or 'ALL'}")
-
-        cursor.execute(base_query, params)
-        records = cursor.fetchall()
-        conn.close()
+            cursor.execute(base_query, params)
+            records = cursor.fetchall()
 
         if not records:
             msg = f"No carry-forward history found for trip {trip_id}"
@@ -804,9 +796,7 @@ def get_carry_forward_log(trip_id: int, family_id: int = Query(None)):
         }
 
     except Exception as e:
-        import traceback
-        print("❌ Error retrieving carry-forward log:", e)
-        traceback.print_exc()
+        log.exception("❌ Error retrieving carry-forward log: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to fetch carry-forward log: {e}")
 
 @app.get("/stay_carry_forward_logs/{trip_id}")
@@ -815,32 +805,31 @@ def list_stay_carry_forward_logs(trip_id: int):
     Returns all carry-forward log entries for a trip,
     enriched with family names and stay period (start → end).
     """
-    conn = get_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    with db() as conn:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
-    cursor.execute("""
-        SELECT 
-            log.id,
-            log.trip_id,
-            log.previous_settlement_id,
-            log.new_settlement_id,
-            log.family_id,
-            f.family_name,
-            log.previous_balance,
-            log.new_balance,
-            log.delta,
-            log.created_at,
-            ss.period_start,
-            ss.period_end
-        FROM stay_carry_forward_log log
-        LEFT JOIN family_details f ON log.family_id = f.id
-        LEFT JOIN stay_settlements ss ON log.new_settlement_id = ss.id
-        WHERE log.trip_id = %s
-        ORDER BY log.created_at DESC;
-    """, (trip_id,))
-
-    logs = cursor.fetchall()
-    conn.close()
+        cursor.execute("""
+            SELECT 
+                log.id,
+                log.trip_id,
+                log.previous_settlement_id,
+                log.new_settlement_id,
+                log.family_id,
+                f.family_name,
+                log.previous_balance,
+                log.new_balance,
+                log.delta,
+                log.created_at,
+                ss.period_start,
+                ss.period_end
+            FROM stay_carry_forward_log log
+            LEFT JOIN family_details f ON log.family_id = f.id
+            LEFT JOIN stay_settlements ss ON log.new_settlement_id = ss.id
+            WHERE log.trip_id = %s
+            ORDER BY log.created_at DESC;
+        """, (trip_id,))
+
+        logs = cursor.fetchall()
 
     return {"trip_id": trip_id, "logs": logs}
 
@@ -850,11 +839,10 @@ def delete_stay_carry_forward_log(log_id: int):
     """
     Deletes a single carry-forward log entry.
     """
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM stay_carry_forward_log WHERE id = %s;", (log_id,))
-    conn.commit()
-    conn.close()
+    with db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM stay_carry_forward_log WHERE id = %s;", (log_id,))
+        conn.commit()
     return {"message": f"Carry-forward log {log_id} deleted successfully."}
 
 @app.delete("/stay_carry_forward_logs/clear/{trip_id}")
@@ -862,11 +850,10 @@ def clear_all_stay_carry_forward_logs(trip_id: int):
     """
     Clears all carry-forward logs for a given trip.
     """
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM stay_carry_forward_log WHERE trip_id = %s;", (trip_id,))
-    conn.commit()
-    conn.close()
+    with db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM stay_carry_forward_log WHERE trip_id = %s;", (trip_id,))
+        conn.commit()
     return {"message": f"All carry-forward logs cleared for trip {trip_id}."}
 
 @app.get("/stay_transactions/{settlement_id}")
@@ -874,22 +861,30 @@ def get_stay_transactions(settlement_id: int):
     """
     Returns all inter-family transactions recorded for a stay settlement.
     """
-    conn = get_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    with db() as conn:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
-    cursor.execute("""
-        SELECT t.id, f1.family_name AS payer, f2.family_name AS receiver, t.amount, t.created_at
-        FROM stay_transactions t
-        JOIN family_details f1 ON t.payer_family_id = f1.id
-        JOIN family_details f2 ON t.receiver_family_id = f2.id
-        WHERE t.settlement_id = %s
-        ORDER BY t.amount DESC;
-    """, (settlement_id,))
-    transactions = cursor.fetchall()
-    conn.close()
+        cursor.execute("""
+            SELECT t.id, f1.family_name AS payer, f2.family_name AS receiver, t.amount, t.created_at
+            FROM stay_transactions t
+            JOIN family_details f1 ON t.payer_family_id = f1.id
+            JOIN family_details f2 ON t.receiver_family_id = f2.id
+            WHERE t.settlement_id = %s
+            ORDER BY t.amount DESC;
+        """, (settlement_id,))
+        transactions = cursor.fetchall()
     return {"settlement_id": settlement_id, "transactions": transactions}
 
 
+def _log_final_families(mode: str, result: dict):
+    """Per-family debug trace; skipped entirely unless DEBUG is enabled."""
+    if not log.isEnabledFor(logging.DEBUG):
+        return
+    log.debug("✅ Final %s result families:", mode)
+    for fam in result.get("families", []):
+        log.debug("  ▶ %s | Net=%s | Adjusted=%s", fam["family_name"], fam["balance"], fam["adjusted_balance"])
+
+
 @app.get("/settlement/{trip_id}")
 def unified_settlement_endpoint(
     trip_id: int,
@@ -905,47 +900,45 @@ def unified_settlement_endpoint(
     """
 
     try:
-        print(f"🧮 Starting unified settlement computations for trip_id={trip_id}, mode={mode}")
+        log.debug("🧮 Starting unified settlement computations for trip_id=%s, mode=%s", trip_id, mode)
 
         # =============================
         # 🏠 STAY MODE CALCULATION
         # =============================
         if mode.upper() == "STAY":
-            result = calculate_stay_settlement(trip_id)
-            result["mode"] = "STAY"
-            result["timestamp"] = datetime.utcnow().isoformat()
-
-            # ✅ Ensure adjusted_balance always exists and is numeric
-            for fam in result.get("families", []):
-                if "adjusted_balance" not in fam:
-                    fam["adjusted_balance"] = fam.get("balance", 0.0)
-                elif fam["adjusted_balance"] is None:
-                    fam["adjusted_balance"] = float(fam.get("balance", 0.0))
-                else:
-                    fam["adjusted_balance"] = float(fam["adjusted_balance"])
-
-            # 🧾 Carry-forward and summary
-            result["carry_forward_total"] = round(
-                sum(f.get("previous_balance", 0.0) for f in result["families"]), 2
-            )
-            result["summary"] = {
-                "total_expense": result.get("total_expense", 0.0),
-                "total_members": result.get("total_members", 0),
-                "per_head_cost": result.get("per_head_cost", 0.0),
-                "families_count": len(result.get("families", []))
-            }
-
-            # 📝 Optionally record this settlement
-            if record:
-                settlement_id = record_stay_settlement(trip_id, result)
-                result["recorded_settlement_id"] = settlement_id
-                result["message"] = f"Stay settlement recorded successfully (ID {settlement_id})"
-
-            print(f"✅ Final STAY result families:")
-            for fam in result.get("families", []):
-                print(f"  ▶ {fam['family_name']} | Net={fam['balance']} | Adjusted={fam['adjusted_balance']}")
-
-            return result
+            # one pooled connection for calculate + optional finalize
+            with db() as conn:
+                result = calculate_stay_settlement(trip_id, conn=conn)
+                result["mode"] = "STAY"
+                result["timestamp"] = datetime.utcnow().isoformat()
+
+                # ✅ Ensure adjusted_balance always exists and is numeric
+                for fam in result.get("families", []):
+                    if "adjusted_balance" not in fam:
+                        fam["adjusted_balance"] = fam.get("balance", 0.0)
+                    elif fam["adjusted_balance"] is None:
+                        fam["adjusted_balance"] = float(fam.get("balance", 0.0))
+                    else:
+                        fam["adjusted_balance"] = float(fam["adjusted_balance"])
+
+                # 🧾 Carry-forward (totalled while rounding families) and summary
+                result["carry_forward_total"] = round(result.get("carry_forward_total", 0.0), 2)
+                result["summary"] = {
+                    "total_expense": result.get("total_expense", 0.0),
+                    "total_members": result.get("total_members", 0),
+                    "per_head_cost": result.get("per_head_cost", 0.0),
+                    "families_count": len(result.get("families", []))
+                }
+
+                # 📝 Optionally record this settlement
+                if record:
+                    settlement_id = record_stay_settlement(trip_id, result, conn=conn)
+                    result["recorded_settlement_id"] = settlement_id
+                    result["message"] = f"Stay settlement recorded successfully (ID {settlement_id})"
+
+                _log_final_families("STAY", result)
+
+                return result
 
         # =============================
         # 🧳 TRIP MODE CALCULATION
@@ -976,16 +969,12 @@ def unified_settlement_endpoint(
                 record_trip_settlement(trip_id, result)
                 result["message"] = "Trip settlement recorded successfully"
 
-            print(f"✅ Final TRIP result families:")
-            for fam in result.get("families", []):
-                print(f"  ▶ {fam['family_name']} | Net={fam['balance']} | Adjusted={fam['adjusted_balance']}")
+            _log_final_families("TRIP", result)
 
             return result
 
     except Exception as e:
-        import traceback
-        print("❌ Unified settlement failed:", e)
-        traceback.print_exc()
+        log.exception("❌ Unified settlement failed: %s", e)
         raise HTTPException(status_code=500, detail=f"Settlement generation failed: {e}")
 
 
@@ -995,19 +984,18 @@ def list_trip_settlements(trip_id: int):
     """
     List all recorded settlements for a given Trip.
     """
-    conn = get_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    with db() as conn:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
-    cursor.execute("""
-        SELECT id, trip_id, period_start, period_end, total_expense, per_head_cost, created_at
-        FROM trip_settlements
-        WHERE trip_id = %s
-        ORDER BY id DESC
-    """, (trip_id,))
-    records = cursor.fetchall()
+        cursor.execute("""
+            SELECT id, trip_id, period_start, period_end, total_expense, per_head_cost, created_at
+            FROM trip_settlements
+            WHERE trip_id = %s
+            ORDER BY id DESC
+        """, (trip_id,))
+        records = cursor.fetchall()
 
-    cursor.close()
-    conn.close()
+        cursor.close()
 
     if not records:
         return {"message": f"No trip settlements found for trip_id {trip_id}"}
@@ -1020,44 +1008,42 @@ def get_trip_settlement_detail(settlement_id: int):
     Retrieve details for a specific recorded trip settlement.
     Includes each family's contribution and balance.
     """
-    conn = get_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    with db() as conn:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+
+        # ✅ Settlement header
+        cursor.execute("""
+            SELECT 
+                s.id, s.trip_id, t.name AS trip_name,
+                s.period_start, s.period_end, 
+                s.total_expense, s.per_head_cost, s.created_at
+            FROM trip_settlements s
+            JOIN trips t ON s.trip_id = t.id
+            WHERE s.id = %s
+        """, (settlement_id,))
+        settlement = cursor.fetchone()
+
+        if not settlement:
+            cursor.close()
+            return {"error": f"Trip settlement record {settlement_id} not found"}
+
+        # ✅ Family-level settlement details
+        cursor.execute("""
+            SELECT 
+                d.family_id, 
+                f.family_name, 
+                d.members_count, 
+                d.total_spent, 
+                d.due_amount, 
+                d.balance
+            FROM trip_settlement_details d
+            JOIN family_details f ON d.family_id = f.id
+            WHERE d.settlement_id = %s
+            ORDER BY f.family_name ASC
+        """, (settlement_id,))
+        details = cursor.fetchall()
 
-    # ✅ Settlement header
-    cursor.execute("""
-        SELECT 
-            s.id, s.trip_id, t.name AS trip_name,
-            s.period_start, s.period_end, 
-            s.total_expense, s.per_head_cost, s.created_at
-        FROM trip_settlements s
-        JOIN trips t ON s.trip_id = t.id
-        WHERE s.id = %s
-    """, (settlement_id,))
-    settlement = cursor.fetchone()
-
-    if not settlement:
         cursor.close()
-        conn.close()
-        return {"error": f"Trip settlement record {settlement_id} not found"}
-
-    # ✅ Family-level settlement details
-    cursor.execute("""
-        SELECT 
-            d.family_id, 
-            f.family_name, 
-            d.members_count, 
-            d.total_spent, 
-            d.due_amount, 
-            d.balance
-        FROM trip_settlement_details d
-        JOIN family_details f ON d.family_id = f.id
-        WHERE d.settlement_id = %s
-        ORDER BY f.family_name ASC
-    """, (settlement_id,))
-    details = cursor.fetchall()
-
-    cursor.close()
-    conn.close()
 
     settlement["details"] = details
     return settlement
@@ -1090,7 +1076,7 @@ def settlement_snapshot(trip_id: int):
     No more stale DB snapshots.
     """
 
-    print(f"📗 Generating LIVE snapshot for report (trip={trip_id}, mode=STAY)")
+    log.debug("📗 Generating LIVE snapshot for report (trip=%s, mode=STAY)", trip_id)
 
     # Call the same calculation used in the UI
     data = unified_settlement_endpoint(
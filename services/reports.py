@@ -5,7 +5,7 @@ import tempfile
 from io import BytesIO
 from datetime import datetime
 from fpdf import FPDF
-from database import get_connection
+from database import db
 import requests
 
 # ============================================================
@@ -44,27 +44,26 @@ class UnicodePDF(FPDF):
 # 🧾 Generate Settlement PDF
 # ============================================================
 def generate_settlement_pdf(trip_id: int):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT 
-            COALESCE(t.name, CONCAT('Trip #', v.trip_id)) AS trip_name,
-            v.total_expense,
-            v.total_members,
-            v.per_head_cost,
-            v.family_summary,
-            v.suggested_settlements,
-            v.created_at
-        FROM v_latest_stay_settlement_snapshot v
-        LEFT JOIN trips t ON v.trip_id = t.id
-        WHERE v.trip_id = %s
-        ORDER BY v.created_at DESC
-        LIMIT 1;
-    """, (trip_id,))
-
-    record = cursor.fetchone()
-    cursor.close()
-    conn.close()
+    with db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT 
+                COALESCE(t.name, CONCAT('Trip #', v.trip_id)) AS trip_name,
+                v.total_expense,
+                v.total_members,
+                v.per_head_cost,
+                v.family_summary,
+                v.suggested_settlements,
+                v.created_at
+            FROM v_latest_stay_settlement_snapshot v
+            LEFT JOIN trips t ON v.trip_id = t.id
+            WHERE v.trip_id = %s
+            ORDER BY v.created_at DESC
+            LIMIT 1;
+        """, (trip_id,))
+
+        record = cursor.fetchone()
+        cursor.close()
 
     if not record:
         raise ValueError(f"No settlement snapshot found for trip {trip_id}")
@@ -1,10 +1,19 @@
 # settlement.py
 
-from datetime import date, timedelta, datetime, timezone
+from datetime import date, timedelta, datetime
+import calendar
+from collections import OrderedDict
+from decimal import Decimal
+from functools import lru_cache
+import copy
 import json
+import logging
+import threading
 import psycopg2.extras
 
-from database import get_connection
+from database import db, float_cursor, get_connection, put_connection
+
+log = logging.getLogger(__name__)
 
 
 # =========================
@@ -12,15 +21,20 @@ from database import get_connection
 # =========================
 def determine_period(period_type: str):
     """Returns (start_date, end_date) for the given period type."""
-    today = date.today()
+    return _period_for(period_type, date.today().toordinal())
+
+
+@lru_cache(maxsize=32)
+def _period_for(period_type: str, today_ord: int):
+    # keyed by the day ordinal, so cached periods roll over at midnight
+    today = date.fromordinal(today_ord)
 
     if period_type == "weekly":
         start = today - timedelta(days=today.weekday())  # Monday
         end = start + timedelta(days=6)
     elif period_type == "monthly":
         start = today.replace(day=1)
-        next_month = start.replace(day=28) + timedelta(days=4)
-        end = next_month - timedelta(days=next_month.day)
+        end = today.replace(day=calendar.monthrange(today.year, today.month)[1])
     else:
         # on_demand: same-day period
         start = end = today
@@ -28,180 +42,187 @@ def determine_period(period_type: str):
     return (start, end)
 
 
-def get_settlement(trip_id: int, start_date: str = None, end_date: str = None, record: bool = False):
-    conn = get_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+# =========================
+# Settlement cache (per trip data version)
+# =========================
+SETTLEMENT_CACHE_SIZE = 256
 
-    # Optional date filter (for future use, TRIP uses full trip normally)
-    date_filter = ""
-    if start_date and end_date:
-        date_filter = "AND e.date BETWEEN %s AND %s"
-        date_params = (trip_id, start_date, end_date)
-    else:
-        date_params = (trip_id,)
+# (mode, trip_id, version...) -> result; stale versions age out of the LRU
+_settlement_cache = OrderedDict()
+_settlement_cache_lock = threading.Lock()
 
-    # --- Step 1: Get families ---
-    cursor.execute("""
-        SELECT id, family_name, members_count
-        FROM family_details
-        WHERE trip_id = %s
-    """, (trip_id,))
-    families_rows = cursor.fetchall()
 
-    if not families_rows:
-        cursor.close()
-        conn.close()
-        return {"message": "No families found for this trip."}
-
-    family_ids = [f["id"] for f in families_rows]
-    family_names = {f["id"]: f["family_name"] for f in families_rows}
-    family_members = {f["id"]: f["members_count"] for f in families_rows}
-
-    # --- Step 2: Expenses (optionally filtered) ---
-    cursor.execute(f"""
-        SELECT payer_family_id, amount
-        FROM expenses e
-        WHERE trip_id = %s {date_filter}
-    """, date_params)
-    expenses = cursor.fetchall()
-
-    expense_balance = {fid: 0.0 for fid in family_ids}
-    total_expense = 0.0
-
-    for e in expenses:
-        payer_id = e["payer_family_id"]
-        amt = float(e["amount"])
-        if payer_id in expense_balance:
-            expense_balance[payer_id] += amt
-            total_expense += amt
-
-    # --- Step 3: Per-head, expected share ---
-    total_members = sum(family_members.values())
-    per_head_cost = total_expense / total_members if total_members > 0 else 0.0
-    expected_share = {fid: family_members[fid] * per_head_cost for fid in family_ids}
-
-    # --- Step 4: Advances (giver = +, taker = -) ---
-    cursor.execute("""
-        SELECT payer_family_id, receiver_family_id, amount
-        FROM advances
-        WHERE trip_id = %s
-    """, (trip_id,))
-    advances_rows = cursor.fetchall()
-
-    advance_balance = {fid: 0.0 for fid in family_ids}
-    for a in advances_rows:
-        payer_id = a["payer_family_id"]
-        receiver_id = a["receiver_family_id"]
-        amt = float(a["amount"])
-        if payer_id in advance_balance:
-            advance_balance[payer_id] += amt   # gave → credit
-        if receiver_id in advance_balance:
-            advance_balance[receiver_id] -= amt  # took → debit
-
-    # --- Step 5: Raw balances (before settlement payments) ---
-    family_results = []
-    for fid in family_ids:
-        paid = float(expense_balance.get(fid, 0.0))
-        owed = float(expected_share.get(fid, 0.0))
-        adv  = float(advance_balance.get(fid, 0.0))
-        net  = paid - owed + adv   # RAW/NET
-
-        family_results.append({
-            "family_id": fid,
-            "family_name": family_names[fid],
-            "members_count": family_members[fid],
-            "total_spent": paid,       # will round later for output
-            "raw_balance": net,        # before settlement payments
-            "balance": net,            # used internally, will keep raw
-            # adjusted_balance will be added after applying settlement txns
-        })
+def _cached_settlement(key, compute):
+    with _settlement_cache_lock:
+        result = _settlement_cache.get(key)
+        if result is not None:
+            _settlement_cache.move_to_end(key)
 
-    # --- Step 5B: Apply Settlement Transactions (TRIP mode adjustments) ---
-    cursor.execute("""
-        SELECT from_family_id, to_family_id, amount
-        FROM settlement_transactions
-        WHERE trip_id = %s
-    """, (trip_id,))
-    txn_rows = cursor.fetchall()
-
-    txn_adjust = {fid: 0.0 for fid in family_ids}
-    for t in txn_rows:
-        f_from = t["from_family_id"]
-        f_to   = t["to_family_id"]
-        amt    = float(t["amount"])
-        # from pays → owes less → balance moves toward zero (increase)
-        txn_adjust[f_from] = txn_adjust.get(f_from, 0.0) + amt
-        # to receives → should receive less → balance moves toward zero (decrease)
-        txn_adjust[f_to] = txn_adjust.get(f_to, 0.0) - amt
-
-    # apply adjustments
-    for fam in family_results:
-        fid = fam["family_id"]
-        adj = txn_adjust.get(fid, 0.0)
-        fam["adjusted_balance"] = fam["balance"] + adj  # balance is net
-
-    # --- Step 6: Suggested settlements derived from adjusted_balance ---
-    # work on copies so we don't mutate family_results
-    debtors = [
-        {
-            "family_name": f["family_name"],
-            "bal": abs(f["adjusted_balance"])
-        }
-        for f in family_results
-        if f["adjusted_balance"] < -0.5  # owes
-    ]
-    creditors = [
-        {
-            "family_name": f["family_name"],
-            "bal": f["adjusted_balance"]
-        }
-        for f in family_results
-        if f["adjusted_balance"] > 0.5   # to receive
-    ]
+    if result is None:
+        result = compute()
+        with _settlement_cache_lock:
+            _settlement_cache[key] = result
+            while len(_settlement_cache) > SETTLEMENT_CACHE_SIZE:
+                _settlement_cache.popitem(last=False)
 
-    transactions = []
-    for d in debtors:
-        owed = d["bal"]
-        for c in creditors:
-            if owed <= 0:
-                break
-            if c["bal"] <= 0:
-                continue
-            payment = min(owed, c["bal"])
-            if payment <= 0:
-                continue
-            transactions.append({
-                "from": d["family_name"],
-                "to": c["family_name"],
-                "amount": round(payment)
+    # callers decorate the result in place, so never hand out the cached dict
+    return copy.deepcopy(result)
+
+
+# =========================
+# TRIP settlement
+# =========================
+def get_settlement(trip_id: int, start_date: str = None, end_date: str = None, record: bool = False, conn=None):
+    with db(conn) as conn:
+        if start_date and end_date:
+            return _compute_settlement(trip_id, start_date, end_date, conn=conn)
+
+        key = ("TRIP", trip_id, _settlement_version(trip_id, conn=conn))
+        return _cached_settlement(key, lambda: _compute_settlement(trip_id, conn=conn))
+
+
+def _settlement_version(trip_id: int, conn=None) -> tuple:
+    """
+    Cheap fingerprint of everything get_settlement reads for a trip.
+    Inserts move count/MAX(id), deletes move the count, and edits bump
+    updated_at (settlement_transactions has no updated_at, so its rows
+    are hashed — it only holds a handful per trip). The latest STAY
+    settlement id covers carry-forward and the period boundary.
+    """
+    with db(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT
+                (SELECT COUNT(*) || ':' || COALESCE(MAX(id), 0) || ':' || COALESCE(MAX(updated_at)::text, '')
+                   FROM family_details WHERE trip_id = %s),
+                (SELECT COUNT(*) || ':' || COALESCE(MAX(id), 0) || ':' || COALESCE(MAX(updated_at)::text, '')
+                   FROM expenses WHERE trip_id = %s),
+                (SELECT COUNT(*) || ':' || COALESCE(MAX(id), 0) || ':' || COALESCE(MAX(updated_at)::text, '')
+                   FROM advances WHERE trip_id = %s),
+                (SELECT md5(COALESCE(string_agg(
+                            concat_ws(':', id, from_family_id, to_family_id, amount, remarks),
+                            ',' ORDER BY id), ''))
+                   FROM settlement_transactions WHERE trip_id = %s),
+                (SELECT COALESCE(MAX(id), 0) FROM stay_settlements WHERE trip_id = %s);
+        """, (trip_id, trip_id, trip_id, trip_id, trip_id))
+        version = cursor.fetchone()
+        cursor.close()
+    return tuple(version)
+
+
+def _compute_settlement(trip_id: int, start_date: str = None, end_date: str = None, conn=None):
+    with db(conn) as conn:
+        cursor = float_cursor(conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor))
+
+        # Optional date filter (for future use, TRIP uses full trip normally);
+        # NULL bounds disable it, so the statement text never changes
+        if not (start_date and end_date):
+            start_date = end_date = None
+
+        # internal aggregates: plain tuple rows, no per-row dict
+        agg = float_cursor(conn.cursor())
+
+        # --- Steps 1-5B: families + per-family paid / advances / settlement adjustments,
+        #     all summed in SQL and joined in one round trip ---
+        #     Row: (family_id, family_name, members_count, paid, advance_net, txn_adj)
+        agg.execute("""
+            WITH paid AS (
+                SELECT payer_family_id AS family_id, SUM(amount) AS paid
+                FROM expenses e
+                WHERE trip_id = %s
+                  AND (%s::text IS NULL OR e.date BETWEEN %s::text AND %s::text)
+                GROUP BY payer_family_id
+            ), adv AS (
+                SELECT family_id, SUM(amount) AS net
+                FROM (
+                    SELECT payer_family_id AS family_id, amount       -- gave → credit
+                    FROM advances
+                    WHERE trip_id = %s
+                    UNION ALL
+                    SELECT receiver_family_id, -amount                -- took → debit
+                    FROM advances
+                    WHERE trip_id = %s
+                ) a
+                GROUP BY family_id
+            ), adj AS (
+                SELECT family_id, SUM(amount) AS adj
+                FROM (
+                    SELECT from_family_id AS family_id, amount       -- from pays → owes less (increase)
+                    FROM settlement_transactions
+                    WHERE trip_id = %s
+                    UNION ALL
+                    SELECT to_family_id, -amount                     -- to receives → gets less (decrease)
+                    FROM settlement_transactions
+                    WHERE trip_id = %s
+                ) t
+                GROUP BY family_id
+            )
+            SELECT fd.id, fd.family_name, fd.members_count,
+                   COALESCE(p.paid, 0)::float8,
+                   COALESCE(v.net, 0)::float8,
+                   COALESCE(t.adj, 0)::float8
+            FROM family_details fd
+            LEFT JOIN paid p ON p.family_id = fd.id
+            LEFT JOIN adv v ON v.family_id = fd.id
+            LEFT JOIN adj t ON t.family_id = fd.id
+            WHERE fd.trip_id = %s
+            ORDER BY fd.id
+        """, (trip_id, start_date, start_date, end_date, trip_id, trip_id, trip_id, trip_id, trip_id))
+        families_rows = agg.fetchall()
+        agg.close()
+
+        if not families_rows:
+            cursor.close()
+            return {"message": "No families found for this trip."}
+
+        # --- Step 3: Per-head, expected share ---
+        total_expense = sum(row[3] for row in families_rows)
+        total_members = sum(row[2] for row in families_rows)
+        per_head_cost = total_expense / total_members if total_members > 0 else 0.0
+
+        # --- Step 5: Raw balances (before settlement payments) + adjusted ---
+        family_results = []
+        for fid, name, members, paid, adv, adj in families_rows:
+            owed = members * per_head_cost
+            net  = paid - owed + adv   # RAW/NET
+
+            family_results.append({
+                "family_id": fid,
+                "family_name": name,
+                "members_count": members,
+                "total_spent": paid,       # will round later for output
+                "raw_balance": net,        # before settlement payments
+                "balance": net,            # used internally, will keep raw
+                "adjusted_balance": net + adj,  # after settlement txns
             })
-            owed     -= payment
-            c["bal"] -= payment
-    # --- Step 7: Fetch settlement transactions (TRIP mode)
-    cursor.execute("""
-        SELECT t.id, 
-            f1.family_name AS from_family,
-            f2.family_name AS to_family,
-            t.amount, 
-            t.transaction_date,
-            t.remarks
-        FROM settlement_transactions t
-        LEFT JOIN family_details f1 ON t.from_family_id = f1.id
-        LEFT JOIN family_details f2 ON t.to_family_id = f2.id
-        WHERE t.trip_id = %s
-        ORDER BY t.id DESC
-    """, (trip_id,))
-    active_transactions = cursor.fetchall()
-
-    # --- Step 7: Round values for output only ---
-    for f in family_results:
-        f["total_spent"]      = round(f["total_spent"])
-        f["raw_balance"]      = round(f["raw_balance"])
-        f["balance"]          = round(f["raw_balance"])  # keep raw as base
-        f["adjusted_balance"] = round(f.get("adjusted_balance", f["raw_balance"]))
-
-    cursor.close()
-    conn.close()
+
+        # --- Step 6: Suggested settlements derived from adjusted_balance ---
+        transactions = _suggest_transactions(family_results)
+
+        # --- Step 7: Fetch settlement transactions (TRIP mode)
+        cursor.execute("""
+            SELECT t.id, 
+                f1.family_name AS from_family,
+                f2.family_name AS to_family,
+                t.amount, 
+                t.transaction_date,
+                t.remarks
+            FROM settlement_transactions t
+            LEFT JOIN family_details f1 ON t.from_family_id = f1.id
+            LEFT JOIN family_details f2 ON t.to_family_id = f2.id
+            WHERE t.trip_id = %s
+            ORDER BY t.id DESC
+        """, (trip_id,))
+        active_transactions = cursor.fetchall()
+
+        # --- Step 7: Round values for output only ---
+        for f in family_results:
+            f["total_spent"]      = round(f["total_spent"])
+            f["raw_balance"]      = round(f["raw_balance"])
+            f["balance"]          = round(f["raw_balance"])  # keep raw as base
+            f["adjusted_balance"] = round(f.get("adjusted_balance", f["raw_balance"]))
+
+        cursor.close()
 
     return {
         "total_expense": round(total_expense),
@@ -216,40 +237,86 @@ def get_settlement(trip_id: int, start_date: str = None, end_date: str = None, r
     }
 
 
+def _suggest_transactions(family_results):
+    """
+    Greedy debtor → creditor matching on adjusted_balance.
+    Pure: remaining amounts live in local lists, family_results is untouched.
+    """
+    debtors = sorted(
+        (f for f in family_results if f["adjusted_balance"] < -0.5),   # owes
+        key=lambda f: f["adjusted_balance"],
+    )
+    creditors = sorted(
+        (f for f in family_results if f["adjusted_balance"] > 0.5),    # to receive
+        key=lambda f: -f["adjusted_balance"],
+    )
+    owed = [-f["adjusted_balance"] for f in debtors]
+    due = [f["adjusted_balance"] for f in creditors]
+
+    # two-pointer sweep over both sides sorted largest-first:
+    # each step settles at least one party, so O(D + C) after the sort
+    transactions = []
+    di = ci = 0
+    while di < len(debtors) and ci < len(creditors):
+        payment = min(owed[di], due[ci])
+        transactions.append({
+            "from": debtors[di]["family_name"],
+            "to": creditors[ci]["family_name"],
+            "amount": round(payment)
+        })
+        owed[di] -= payment
+        due[ci] -= payment
+        if owed[di] < 0.01:
+            di += 1
+        if due[ci] < 0.01:
+            ci += 1
+    return transactions
+
+
 def get_trip_summary(trip_id: int):
-    conn = get_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    with db() as conn:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+
+        # --- Trip, families and expenses in one round trip (aggregated to JSON by Postgres) ---
+        cursor.execute("""
+            WITH t AS (
+                SELECT row_to_json(tr) AS j
+                FROM trips tr
+                WHERE tr.id = %s
+            ), f AS (
+                SELECT COALESCE(json_agg(x), '[]') AS j
+                FROM (
+                    SELECT id, family_name, members_count
+                    FROM family_details
+                    WHERE trip_id = %s
+                ) x
+            ), e AS (
+                SELECT COALESCE(json_agg(
+                           json_build_object(
+                               'expense_name', e.expense_name,
+                               'amount', e.amount,
+                               'date', e.date,
+                               'payer', f.family_name
+                           ) ORDER BY e.date ASC, e.id ASC
+                       ), '[]') AS j
+                FROM expenses e
+                JOIN family_details f ON e.payer_family_id = f.id
+                WHERE e.trip_id = %s
+            )
+            SELECT t.j AS trip, f.j AS families, e.j AS expenses
+            FROM t, f, e;
+        """, (trip_id, trip_id, trip_id))
+        row = cursor.fetchone()
 
-    # --- Trip info ---
-    cursor.execute("SELECT * FROM trips WHERE id = %s", (trip_id,))
-    trip = cursor.fetchone()
-    if not trip:
         cursor.close()
-        conn.close()
-        return {"error": f"Trip with id {trip_id} not found"}
-
-    # --- Families ---
-    cursor.execute("""
-        SELECT id, family_name, members_count
-        FROM family_details
-        WHERE trip_id = %s
-    """, (trip_id,))
-    families = cursor.fetchall()
-
-    # --- Expenses ---
-    cursor.execute("""
-        SELECT e.expense_name, e.amount, e.date, f.family_name AS payer
-        FROM expenses e
-        JOIN family_details f ON e.payer_family_id = f.id
-        WHERE e.trip_id = %s
-        ORDER BY e.date ASC, e.id ASC
-    """, (trip_id,))
-    expenses = cursor.fetchall()
-
-    cursor.close()
-    conn.close()
-
-    settlement_data = get_settlement(trip_id)
+
+        if not row:
+            return {"error": f"Trip with id {trip_id} not found"}
+
+        # same connection for the settlement (version probe / compute)
+        settlement_data = get_settlement(trip_id, conn=conn)
+
+    trip, families, expenses = row["trip"], row["families"], row["expenses"]
 
     return {
         "trip": trip,
@@ -257,26 +324,10 @@ def get_trip_summary(trip_id: int):
         "expenses": expenses,
         "settlement": settlement_data
     }
-# =========================
-# Fetch last STAY settlement
-# =========================
-def get_last_stay_settlement(trip_id: int):
-    conn = get_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    cursor.execute(
-        """
-        SELECT id, period_start, period_end, created_at
-        FROM stay_settlements
-        WHERE trip_id = %s
-        ORDER BY id DESC
-        LIMIT 1
-        """,
-        (trip_id,),
-    )
-    result = cursor.fetchone()
-    cursor.close()
-    conn.close()
-    return result
+
+
+# expenses.created_at probe result; the schema doesn't change under a running process
+_expenses_has_created_at = None
 
 
 def _build_expense_time_filter(cursor, prev_end_date, prev_created_at):
@@ -288,16 +339,18 @@ def _build_expense_time_filter(cursor, prev_end_date, prev_created_at):
     if not prev_end_date and not prev_created_at:
         return ("", ())
 
-    # Check if expenses.created_at exists
-    cursor.execute("""
-        SELECT 1
-        FROM information_schema.columns
-        WHERE table_name = 'expenses' AND column_name = 'created_at'
-        LIMIT 1;
-    """)
-    has_created_at = cursor.fetchone() is not None
-
-    if has_created_at and prev_created_at:
+    # Check if expenses.created_at exists (once per process)
+    global _expenses_has_created_at
+    if _expenses_has_created_at is None:
+        cursor.execute("""
+            SELECT 1
+            FROM information_schema.columns
+            WHERE table_name = 'expenses' AND column_name = 'created_at'
+            LIMIT 1;
+        """)
+        _expenses_has_created_at = cursor.fetchone() is not None
+
+    if _expenses_has_created_at and prev_created_at:
         # strict: after instant of last finalize
         return (" AND e.created_at > %s ", (prev_created_at,))
     else:
@@ -308,7 +361,7 @@ def _build_expense_time_filter(cursor, prev_end_date, prev_created_at):
 # =============================================
 # Core: Calculate STAY settlement (current view)
 # =============================================
-def calculate_stay_settlement(trip_id: int):
+def calculate_stay_settlement(trip_id: int, conn=None):
     """
     STAY mode settlement:
     - Per-head cost based on total members
@@ -318,178 +371,195 @@ def calculate_stay_settlement(trip_id: int):
     - Internals use floats; round only for output & suggestions
     - IMPORTANT: Expenses are limited to the current period
                  (i.e., only after the last finalized settlement).
+    Cached per data version; the period ends today, so the day is part of the key.
     """
-    conn = get_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-
-    # 1) Previous settlement (for carry-forward & period boundary)
-    cursor.execute("""
-        SELECT id, period_end, created_at
-        FROM stay_settlements
-        WHERE trip_id = %s
-        ORDER BY id DESC
-        LIMIT 1;
-    """, (trip_id,))
-    prev = cursor.fetchone()
-    prev_settlement_id = prev["id"] if prev else None
-    prev_end_date = prev["period_end"] if prev else None
-    prev_created_at = prev["created_at"] if prev and "created_at" in prev else None
-
-    time_where_sql, time_where_params = _build_expense_time_filter(cursor, prev_end_date, prev_created_at)
-
-    # 2) total_expense (PERIOD ONLY), total_members, per-head cost (float)
-    cursor.execute(
-        f"""SELECT COALESCE(SUM(e.amount), 0) AS total_expense
-            FROM expenses e
-            WHERE e.trip_id = %s {time_where_sql};
-        """,
-        (trip_id, *time_where_params) if time_where_params else (trip_id,)
-    )
-    total_expense = float(cursor.fetchone()["total_expense"] or 0.0)
-
-    cursor.execute(
-        "SELECT COALESCE(SUM(members_count), 0) AS total_members FROM family_details WHERE trip_id = %s;",
-        (trip_id,),
-    )
-    total_members = int(cursor.fetchone()["total_members"] or 0) or 1
-    per_head_cost = total_expense / total_members
-
-    # 3) Carry-forward map — from the latest finalized settlement (ADJUSTED preferred)
-    previous_balance_map = {}
-    if prev_settlement_id:
-        with get_connection() as cf_conn:
-            cf_cur = cf_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-            cf_cur.execute(
-                """
-                SELECT ssd.family_id,
-                       COALESCE(ssd.adjusted_balance, ssd.balance, 0.0) AS carry_forward_balance
-                FROM stay_settlement_details ssd
-                WHERE ssd.settlement_id = %s;
-                """,
-                (prev_settlement_id,),
-            )
-            for row in cf_cur.fetchall():
-                previous_balance_map[row["family_id"]] = float(row["carry_forward_balance"] or 0.0)
-            cf_cur.close()
-
-    print(f"🧾 [DEBUG] Loaded carry-forward map for trip {trip_id}: {previous_balance_map}")
-
-    # 4) Compute family balances (Net) using only PERIOD expenses
-    cursor.execute(
-        """
-        SELECT id AS family_id, family_name, members_count
-        FROM family_details
-        WHERE trip_id = %s
-        ORDER BY id;
-        """,
-        (trip_id,),
-    )
-    families = cursor.fetchall()
-
-    results = []
-    for f in families:
-        fid = f["family_id"]
-        # period-spent for this family
-        cursor.execute(
+    with db(conn) as conn:
+        today = datetime.utcnow().date()
+        key = ("STAY", trip_id, _settlement_version(trip_id, conn=conn), today)
+        return _cached_settlement(key, lambda: _compute_stay_settlement(trip_id, today, conn=conn))
+
+
+def _compute_stay_settlement(trip_id: int, today: date, conn=None):
+    with db(conn) as conn:
+        cursor = float_cursor(conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor))
+        # internal aggregates: plain tuple rows, no per-row dict
+        agg = float_cursor(conn.cursor())
+
+        # 1) Previous settlement (for period boundary) + its carry-forward rows
+        #    (ADJUSTED preferred) for the UI breakdown — one query on the same cursor.
+        #    Per-family previous balances are joined again inside step 2.
+        #    Row: (id, period_end, created_at, family_id, carry_forward_balance)
+        agg.execute("""
+            SELECT ss.id, ss.period_end, ss.created_at,
+                   ssd.family_id,
+                   COALESCE(ssd.adjusted_balance, ssd.balance, 0.0) AS carry_forward_balance
+            FROM (
+                SELECT id, period_end, created_at
+                FROM stay_settlements
+                WHERE trip_id = %s
+                ORDER BY id DESC
+                LIMIT 1
+            ) ss
+            LEFT JOIN stay_settlement_details ssd ON ssd.settlement_id = ss.id;
+        """, (trip_id,))
+        prev_rows = agg.fetchall()
+        if prev_rows:
+            prev_settlement_id, prev_end_date, prev_created_at = prev_rows[0][:3]
+        else:
+            prev_settlement_id = prev_end_date = prev_created_at = None
+
+        carry_forward_breakdown = [
+            {"family_id": fid, "previous_balance": cf_balance or 0.0}
+            for _, _, _, fid, cf_balance in prev_rows
+            if fid is not None
+        ]
+
+        time_where_sql, time_where_params = _build_expense_time_filter(agg, prev_end_date, prev_created_at)
+
+        # 2) Per-family settlement math in one round trip:
+        #    PERIOD spend, PERIOD total_expense, per-head due, previous carry-forward,
+        #    NET and ADJUSTED (NET + active settlement transactions).
+        #    float8 keeps the arithmetic identical to the former Python floats; the
+        #    total rides along on a single NULL-family row when there are no families yet.
+        #    Row: (total_expense, family_id, family_name, members_count, spent, due,
+        #          prev_balance, balance, adj, adjusted_balance, total_members)
+        agg.execute(
             f"""
-            SELECT COALESCE(SUM(e.amount), 0) AS spent
-            FROM expenses e
-            WHERE e.trip_id = %s AND e.payer_family_id = %s {time_where_sql};
+            WITH spent AS (
+                SELECT e.payer_family_id, SUM(e.amount) AS spent
+                FROM expenses e
+                WHERE e.trip_id = %s {time_where_sql}
+                GROUP BY e.payer_family_id
+            ), tot AS (
+                SELECT COALESCE(SUM(spent), 0)::float8 AS total_expense FROM spent
+            ), adj AS (
+                SELECT family_id, SUM(delta) AS adj
+                FROM (
+                    SELECT from_family_id AS family_id, amount AS delta   -- pays → +amt
+                    FROM settlement_transactions
+                    WHERE trip_id = %s
+                    UNION ALL
+                    SELECT to_family_id, -amount                          -- receives → -amt
+                    FROM settlement_transactions
+                    WHERE trip_id = %s
+                ) u
+                GROUP BY family_id
+            ), fam AS (
+                SELECT fd.id AS family_id, fd.family_name, fd.members_count,
+                       COALESCE(s.spent, 0)::float8 AS spent,
+                       COALESCE(p.adjusted_balance, p.balance, 0)::float8 AS prev_balance,
+                       COALESCE(a.adj, 0)::float8 AS adj,
+                       GREATEST(SUM(fd.members_count) OVER (), 1) AS total_members
+                FROM family_details fd
+                LEFT JOIN spent s ON s.payer_family_id = fd.id
+                LEFT JOIN stay_settlement_details p
+                       ON p.settlement_id = %s AND p.family_id = fd.id
+                LEFT JOIN adj a ON a.family_id = fd.id
+                WHERE fd.trip_id = %s
+            ), calc AS (
+                SELECT fam.*,
+                       tot.total_expense / fam.total_members * fam.members_count AS due
+                FROM fam, tot
+            ), net AS (
+                SELECT calc.*, prev_balance + (spent - due) AS balance
+                FROM calc
+            )
+            SELECT tot.total_expense,
+                   net.family_id, net.family_name, net.members_count,
+                   net.spent, net.due, net.prev_balance, net.balance, net.adj,
+                   net.balance + net.adj AS adjusted_balance,
+                   net.total_members
+            FROM tot
+            LEFT JOIN net ON TRUE
+            ORDER BY net.family_id;
             """,
-            (trip_id, fid, *time_where_params) if time_where_params else (trip_id, fid)
+            (trip_id, *time_where_params, trip_id, trip_id, prev_settlement_id, trip_id),
         )
-        spent = float(cursor.fetchone()["spent"] or 0.0)
-        due = per_head_cost * int(f["members_count"])
-        prev_bal = previous_balance_map.get(fid, 0.0)
-
-        net = prev_bal + (spent - due)
-
-        results.append(
-            {
-                "family_id": fid,
-                "family_name": f["family_name"],
-                "members_count": int(f["members_count"]),
-                "total_spent": spent,
-                "due_amount": due,
-                "previous_balance": prev_bal,
-                "balance": net,  # NET (before payments)
-            }
-        )
-        print(
-            f"🧮 [DEBUG] Family {f['family_name']}: spent={spent:.2f}, due={due:.2f}, prev={prev_bal:.2f}, net={net:.2f}"
-        )
-
-    # 5) Load transactions for UI tabs
-    #    - active = used in ADJUSTED (current period)
-    #    - archived = last settlement's transactions (for UI only; NOT re-applied)
-    cursor.execute(
-        """
-        SELECT t.id, t.from_family_id,
-               f1.family_name AS from_family,
-               t.to_family_id,
-               f2.family_name AS to_family,
-               t.amount, t.transaction_date, t.remarks
-        FROM settlement_transactions t
-        LEFT JOIN family_details f1 ON t.from_family_id = f1.id
-        LEFT JOIN family_details f2 ON t.to_family_id = f2.id
-        WHERE t.trip_id = %s
-        ORDER BY t.id;
-        """,
-        (trip_id,),
-    )
-    active_txns = cursor.fetchall()
-    for txn in active_txns:
-        txn["from"] = txn.get("from_family")
-        txn["to"] = txn.get("to_family")
+        rows = agg.fetchall()
+        agg.close()
+        total_expense = rows[0][0]
+        families = [r[1:] for r in rows if r[1] is not None]
+
+        # total_members, per-head cost (float)
+        total_members = int(families[0][-1]) if families else 1
+        per_head_cost = total_expense / total_members
+
+        # 3) Carry-forward rows were loaded together with the previous settlement
+        log.debug("🧾 Loaded carry-forward breakdown for trip %s: %s", trip_id, carry_forward_breakdown)
+
+        # 4) Family balances (Net / Adjusted) as computed above, using only PERIOD expenses
+        results = []
+        total_adj = 0.0
+        for fid, name, members, spent, due, prev_bal, net, adj, adjusted, _ in families:
+            results.append(
+                {
+                    "family_id": fid,
+                    "family_name": name,
+                    "members_count": int(members),
+                    "total_spent": spent,
+                    "due_amount": due,
+                    "previous_balance": prev_bal,
+                    "balance": net,  # NET (before payments)
+                    "adjusted_balance": adjusted,
+                }
+            )
+            total_adj += adjusted
+            # adjustments from ACTIVE transactions only ("from" pays → +amt; "to" receives → -amt)
+            log.debug(
+                "🧮 Family %s: spent=%.2f, due=%.2f, prev=%.2f, net=%.2f + adj(%+.2f) = adjusted=%.2f",
+                name, spent, due, prev_bal, net, adj, adjusted,
+            )
 
-    cursor.execute(
-        """
-        SELECT sta.id, sta.from_family_id,
-               f1.family_name AS from_family,
-               sta.to_family_id,
-               f2.family_name AS to_family,
-               sta.amount, sta.transaction_date, sta.remarks, sta.settlement_id
-        FROM settlement_transactions_archive sta
-        LEFT JOIN family_details f1 ON sta.from_family_id = f1.id
-        LEFT JOIN family_details f2 ON sta.to_family_id = f2.id
-        WHERE sta.trip_id = %s
-          AND sta.settlement_id = (SELECT MAX(id) FROM stay_settlements WHERE trip_id = %s)
-        ORDER BY sta.id;
-        """,
-        (trip_id, trip_id),
-    )
-    archived_txns = cursor.fetchall()
-    for txn in archived_txns:
-        txn["from"] = txn.get("from_family")
-        txn["to"] = txn.get("to_family")
-
-    # 6) Apply adjustments from ACTIVE transactions ONLY
-    #    ("from" pays → +amt; "to" receives → -amt)
-    adjustments = {f["family_id"]: 0.0 for f in results}
-    for txn in active_txns:
-        f_from, f_to = txn["from_family_id"], txn["to_family_id"]
-        amt = float(txn["amount"])
-        adjustments[f_from] = adjustments.get(f_from, 0.0) + amt
-        adjustments[f_to] = adjustments.get(f_to, 0.0) - amt
-
-    print("🔧 Adjustments applied (ACTIVE transactions only):")
-    for f in results:
-        fid = f["family_id"]
-        adj = adjustments.get(fid, 0.0)
-        adjusted = f["balance"] + adj
-        f["adjusted_balance"] = adjusted
-        print(
-            f"▶ {f['family_name']}: Net={f['balance']:.2f} + Adj({adj:+.2f}) = Adjusted={adjusted:.2f}"
+        # 5) Load transactions for UI tabs, both sets in one round trip
+        #    - active = used in ADJUSTED (current period)
+        #    - archived = last settlement's transactions (for UI only; NOT re-applied);
+        #      none on the first STAY period (settlement_id = NULL matches nothing)
+        cursor.execute(
+            """
+            SELECT 'active' AS src, t.id, t.from_family_id,
+                   f1.family_name AS from_family,
+                   t.to_family_id,
+                   f2.family_name AS to_family,
+                   t.amount, t.transaction_date, t.remarks, NULL::int AS settlement_id
+            FROM settlement_transactions t
+            LEFT JOIN family_details f1 ON t.from_family_id = f1.id
+            LEFT JOIN family_details f2 ON t.to_family_id = f2.id
+            WHERE t.trip_id = %s
+            UNION ALL
+            SELECT 'archived', sta.id, sta.from_family_id,
+                   f1.family_name,
+                   sta.to_family_id,
+                   f2.family_name,
+                   sta.amount, sta.transaction_date, sta.remarks, sta.settlement_id
+            FROM settlement_transactions_archive sta
+            LEFT JOIN family_details f1 ON sta.from_family_id = f1.id
+            LEFT JOIN family_details f2 ON sta.to_family_id = f2.id
+            WHERE sta.trip_id = %s
+              AND sta.settlement_id = %s   -- latest settlement, already loaded in step 1
+            ORDER BY src, id;
+            """,
+            (trip_id, trip_id, prev_settlement_id),
         )
-
-    # 6b) Ensure the adjusted balances sum to exactly 0.00 (guard tiny drift)
-    total_adj = sum(f["adjusted_balance"] for f in results)
+        active_txns, archived_txns = [], []
+        for txn in cursor.fetchall():
+            txn["from"] = txn.get("from_family")
+            txn["to"] = txn.get("to_family")
+            if txn.pop("src") == "active":
+                del txn["settlement_id"]
+                active_txns.append(txn)
+            else:
+                archived_txns.append(txn)
+
+
+    # 6) Ensure the adjusted balances sum to exactly 0.00 (guard tiny drift);
+    #    total_adj was summed while building results in step 4
     if abs(total_adj) > 0.01:
         # apply correction to the largest absolute adjusted so the vector sum is 0
         target = max(results, key=lambda x: abs(x["adjusted_balance"]))
         target["adjusted_balance"] -= total_adj
-        print(
-            f"🔧 Final correction {(-total_adj):+.2f} applied to {target['family_name']} (ensured total=0.00)"
+        log.debug(
+            "🔧 Final correction %+.2f applied to %s (ensured total=0.00)",
+            -total_adj, target["family_name"],
         )
 
     # 7) Suggested settlements (from adjusted)
@@ -531,15 +601,16 @@ def calculate_stay_settlement(trip_id: int):
         if abs(debtors[di]["bal"]) < 0.01:
             di += 1
 
-    # 8) Period & finalize output (round for UI only)
-    period_start = (prev_end_date + timedelta(days=1)) if prev_end_date else datetime.utcnow().date()
-    period_end = datetime.utcnow().date()
-    conn.close()
+    # 8) Period & finalize output (round for UI only); today is the cache key's day
+    period_start = (prev_end_date + timedelta(days=1)) if prev_end_date else today
+    period_end = today
 
+    carry_forward_total = 0
     for f in results:
         f["total_spent"] = round(f["total_spent"])
         f["due_amount"] = round(f["due_amount"])
         f["previous_balance"] = round(f["previous_balance"])
+        carry_forward_total += f["previous_balance"]
         f["balance"] = round(f["balance"])
         f["adjusted_balance"] = round(f["adjusted_balance"])
 
@@ -550,11 +621,9 @@ def calculate_stay_settlement(trip_id: int):
         "total_members": total_members,
         "per_head_cost": round(per_head_cost),
         "families": results,
-        "carry_forward": bool(previous_balance_map),
-        "carry_forward_breakdown": [
-            {"family_id": fid, "previous_balance": bal}
-            for fid, bal in previous_balance_map.items()
-        ],
+        "carry_forward": bool(carry_forward_breakdown),
+        "carry_forward_breakdown": carry_forward_breakdown,
+        "carry_forward_total": carry_forward_total,
         "previous_settlement_id": prev_settlement_id,
         "active_transactions": active_txns,
         "archived_transactions": archived_txns,  # for UI only
@@ -566,7 +635,7 @@ def calculate_stay_settlement(trip_id: int):
 # ======================================
 # Finalize & record STAY settlement
 # ======================================
-def record_stay_settlement(trip_id: int, result: dict):
+def record_stay_settlement(trip_id: int, result: dict, conn=None):
     """
     Finalizes and records the stay settlement.
     - Saves summary and family-level balances (both net & adjusted)
@@ -574,58 +643,117 @@ def record_stay_settlement(trip_id: int, result: dict):
     - Creates idempotent carry-forward log
     - Prevents accidental duplicate re-finalization (<5s)
     - If everything is already adjusted to zero, records a zero-closure settlement
+    Pass the connection used for calculate_stay_settlement to finalize on it;
+    it is committed here but stays owned by the caller.
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    own_conn = conn is None
+    if own_conn:
+        conn = get_connection()
+    cursor = float_cursor(conn.cursor())
 
-    print(f"🧾 Finalizing stay settlement for trip {trip_id}...")
+    try:
+        log.info("🧾 Finalizing stay settlement for trip %s...", trip_id)
 
-    # prevent immediate re-finalization within 5 seconds
-    cursor.execute(
-        """
-        SELECT id, created_at
-        FROM stay_settlements
-        WHERE trip_id = %s
-        ORDER BY id DESC LIMIT 1;
-        """,
-        (trip_id,),
-    )
-    existing = cursor.fetchone()
-    prev_id = result.get("previous_settlement_id")
-    last_id = existing[0] if existing else None
-    print(
-        f"🔍 Checking duplicate prevention: prev_id={prev_id}, last_settlement_in_db={last_id}"
-    )
+        # serialize finalization per trip: a concurrent finalize waits here until this
+        # transaction commits (lock is released automatically at commit/rollback)
+        cursor.execute(
+            "SELECT pg_advisory_xact_lock(hashtext('stay_settlement'), %s);",
+            (trip_id,),
+        )
 
-    if existing and existing[1]:
-        created_time = existing[1].replace(tzinfo=None)
-        now = datetime.now(timezone.utc).replace(tzinfo=None)
-        seconds_since = (now - created_time).total_seconds()
-        if seconds_since < 5:
-            print(
-                f"⚠️ Skipping immediate re-finalization for trip {trip_id} "
-                f"(last settlement {seconds_since:.1f}s ago)"
-            )
-            conn.close()
-            return last_id
-
-    # Always allow recording; if all balances are ~0, treat as closure entry
-    all_balances = [round(f.get("adjusted_balance", f["balance"]), 2) for f in result["families"]]
-    if all(abs(b) < 0.01 for b in all_balances):
-        print(
-            f"ℹ️ All balances are settled for trip {trip_id}, recording zero-balance closure entry."
+        # prevent immediate re-finalization within 5 seconds (age measured by the
+        # database clock, the same one that stamped created_at)
+        cursor.execute(
+            """
+            SELECT id, EXTRACT(EPOCH FROM (LOCALTIMESTAMP - created_at)) AS seconds_since
+            FROM stay_settlements
+            WHERE trip_id = %s
+            ORDER BY id DESC LIMIT 1;
+            """,
+            (trip_id,),
+        )
+        existing = cursor.fetchone()
+        prev_id = result.get("previous_settlement_id")
+        last_id = existing[0] if existing else None
+        log.debug(
+            "🔍 Checking duplicate prevention: prev_id=%s, last_settlement_in_db=%s", prev_id, last_id
         )
 
-    try:
-        # 1) summary row
+        if existing and existing[1] is not None:
+            seconds_since = existing[1]
+            if seconds_since < 5:
+                log.warning(
+                    "⚠️ Skipping immediate re-finalization for trip %s (last settlement %.1fs ago)",
+                    trip_id, seconds_since,
+                )
+                conn.rollback()  # nothing written; releases the advisory lock
+                return last_id
+
+        # Always allow recording; if all balances are ~0, treat as closure entry
+        all_balances = [round(f.get("adjusted_balance", f["balance"]), 2) for f in result["families"]]
+        if all(abs(b) < 0.01 for b in all_balances):
+            log.info(
+                "ℹ️ All balances are settled for trip %s, recording zero-balance closure entry.", trip_id
+            )
+
+        # 1+2+4) summary row + details (both net & adjusted) + archive & clear of
+        #        active settlement transactions in one round trip: the summary id
+        #        comes from a data-modifying CTE, the detail rows are shipped as a
+        #        single JSON parameter and the DELETE hands its rows straight to
+        #        the archive INSERT
+        details = []
+        for f in result["families"]:
+            net_balance = round(f.get("balance", 0.0), 2)
+            adjusted_balance = round(f.get("adjusted_balance", net_balance), 2)
+            if abs(adjusted_balance) < 0.01:
+                adjusted_balance = 0.0
+            if abs(net_balance) < 0.01:
+                net_balance = 0.0
+            details.append({
+                "family_id": f["family_id"],
+                "family_name": f.get("family_name"),
+                "members_count": f.get("members_count"),
+                "total_spent": f.get("total_spent"),
+                "due_amount": f.get("due_amount"),
+                "balance": net_balance,
+                "adjusted_balance": adjusted_balance,
+            })
+
         cursor.execute(
             """
-            INSERT INTO stay_settlements (
-                trip_id, total_expense, total_members, per_head_cost,
-                period_start, period_end, created_at
+            WITH s AS (
+                INSERT INTO stay_settlements (
+                    trip_id, total_expense, total_members, per_head_cost,
+                    period_start, period_end, created_at
+                )
+                VALUES (%s, %s, %s, %s, %s, %s, NOW())
+                RETURNING id
+            ), d AS (
+                INSERT INTO stay_settlement_details (
+                    settlement_id, family_id, family_name, members_count,
+                    total_spent, due_amount, balance, adjusted_balance
+                )
+                SELECT s.id, v.family_id, v.family_name, v.members_count,
+                       v.total_spent, v.due_amount, v.balance, v.adjusted_balance
+                FROM s, json_to_recordset(%s::json) AS v (
+                    family_id INTEGER, family_name TEXT, members_count INTEGER,
+                    total_spent NUMERIC, due_amount NUMERIC,
+                    balance NUMERIC, adjusted_balance NUMERIC
+                )
+            ), moved AS (
+                DELETE FROM settlement_transactions
+                WHERE trip_id = %s
+                RETURNING id, trip_id, from_family_id, to_family_id, amount, transaction_date, remarks
+            ), archived AS (
+                INSERT INTO settlement_transactions_archive (
+                    trip_id, from_family_id, to_family_id, amount, transaction_date, remarks, settlement_id
+                )
+                SELECT m.trip_id, m.from_family_id, m.to_family_id, m.amount, m.transaction_date, m.remarks, s.id
+                FROM moved m, s
+                ORDER BY m.id
+                RETURNING 1
             )
-            VALUES (%s, %s, %s, %s, %s, %s, NOW())
-            RETURNING id;
+            SELECT s.id, (SELECT COUNT(*) FROM archived) FROM s;
             """,
             (
                 trip_id,
@@ -634,33 +762,19 @@ def record_stay_settlement(trip_id: int, result: dict):
                 result["per_head_cost"],
                 result["period_start"],
                 result["period_end"],
+                json.dumps(details),
+                trip_id,
             ),
         )
-        settlement_id = cursor.fetchone()[0]
-        print(f"✅ Settlement summary saved (ID={settlement_id})")
-
-        # 2) details — store both net & adjusted
-        for f in result["families"]:
-            net_balance = round(float(f.get("balance", 0.0)), 2)
-            adjusted_balance = round(float(f.get("adjusted_balance", net_balance)), 2)
-            if abs(adjusted_balance) < 0.01:
-                adjusted_balance = 0.0
-            if abs(net_balance) < 0.01:
-                net_balance = 0.0
-            cursor.execute(
-                """
-                INSERT INTO stay_settlement_details (
-                    settlement_id, family_id, balance, adjusted_balance
-                ) VALUES (%s, %s, %s, %s);
-                """,
-                (settlement_id, f["family_id"], net_balance, adjusted_balance),
-            )
-        print("✅ Family-level settlement details saved.")
-        conn.commit()      # commit summary + details before logging
-        print(f"✅ Settlement summary & details committed (ID={settlement_id})")
+        settlement_id, archived_count = cursor.fetchone()
+        log.debug("✅ Settlement summary & %d family-level details saved (ID=%s)", len(details), settlement_id)
+        log.debug(
+            "📦 Archived and cleared %d settlement transactions for trip_id=%s → settlement_id=%s",
+            archived_count, trip_id, settlement_id,
+        )
 
         # 3) carry-forward log (idempotent and correct ordering)
-        print(f"🧾 Calling record_carry_forward_log(prev={prev_id}, new={settlement_id})")
+        log.debug("🧾 Calling record_carry_forward_log(prev=%s, new=%s)", prev_id, settlement_id)
         record_carry_forward_log(
             prev_settlement_id=prev_id,
             new_settlement_id=settlement_id,
@@ -668,16 +782,9 @@ def record_stay_settlement(trip_id: int, result: dict):
             cursor=cursor,
         )
 
-        # 3b) settlement history snapshot (safe no-op if table missing)
-        carry_forward_map = {}
-        cursor.execute("""
-            SELECT family_id, adjusted_balance
-            FROM stay_settlement_details
-            WHERE settlement_id = %s;
-        """, (settlement_id,))
-        for row in cursor.fetchall():
-            fid, adj = row[0], float(row[1] or 0.0)
-            carry_forward_map[fid] = adj
+        # 3b) settlement history snapshot (safe no-op if table missing);
+        #     the carry-forward map is exactly the detail rows written above
+        carry_forward_map = {d["family_id"]: d["adjusted_balance"] for d in details}
 
         record_settlement_snapshot(
             trip_id=trip_id,
@@ -685,39 +792,22 @@ def record_stay_settlement(trip_id: int, result: dict):
             new_settlement_id=settlement_id,
             mode="STAY",
             result_data=result,
-            carry_forward_map=carry_forward_map
-        )
-
-        # 4) archive & clear active settlement transactions
-        cursor.execute(
-            """
-            INSERT INTO settlement_transactions_archive (
-                trip_id, from_family_id, to_family_id, amount, transaction_date, remarks, settlement_id
-            )
-            SELECT trip_id, from_family_id, to_family_id, amount, transaction_date, remarks, %s
-            FROM settlement_transactions
-            WHERE trip_id = %s;
-            """,
-            (settlement_id, trip_id),
-        )
-        cursor.execute("DELETE FROM settlement_transactions WHERE trip_id = %s;", (trip_id,))
-        print(
-            f"📦 Archived and cleared settlement transactions for trip_id={trip_id} → settlement_id={settlement_id}"
+            carry_forward_map=carry_forward_map,
+            cursor=cursor,
         )
 
         conn.commit()
-        print(f"🏁 Stay settlement completed successfully (ID={settlement_id})")
+        log.info("🏁 Stay settlement completed successfully (ID=%s)", settlement_id)
         return settlement_id
 
     except Exception as e:
         conn.rollback()
-        import traceback
-        print(f"❌ Error while recording stay settlement: {e}")
-        traceback.print_exc()
+        log.exception("❌ Error while recording stay settlement: %s", e)
         raise
 
     finally:
-        conn.close()
+        if own_conn:
+            put_connection(conn)
 
 
 def record_trip_settlement(trip_id: int, result: dict) -> int:
@@ -725,48 +815,57 @@ def record_trip_settlement(trip_id: int, result: dict) -> int:
     Records a trip settlement into trip_settlements and trip_settlement_details.
     Returns the new settlement_id.
     """
-    conn = get_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    with db() as conn:
+        cursor = conn.cursor()
 
-    # Insert into trip_settlements
-    cursor.execute("""
-        INSERT INTO trip_settlements (
-            trip_id, mode, period_start, period_end, total_expense, per_head_cost
-        )
-        VALUES (%s, %s, %s, %s, %s, %s)
-        RETURNING id
-    """, (
-        trip_id,
-        result.get("mode", "TRIP"),
-        result.get("period_start", datetime.utcnow().date()),
-        result.get("period_end", datetime.utcnow().date()),
-        result.get("total_expense", 0.0),
-        result.get("per_head_cost", 0.0)
-    ))
-    settlement_id = cursor.fetchone()["id"]
-
-    # Insert family-level details
-    for fam in result.get("families", []):
+        details = [
+            {
+                "family_id": fam.get("family_id"),
+                "family_name": fam.get("family_name"),
+                "members_count": fam.get("members_count"),
+                "total_spent": fam.get("total_spent"),
+                "due_amount": fam.get("raw_balance", 0.0),  # raw_balance acts as due_amount here
+                "balance": fam.get("balance", 0.0),
+            }
+            for fam in result.get("families", [])
+        ]
+
+        # Insert into trip_settlements + family-level details in one statement
+        today = datetime.utcnow().date()
         cursor.execute("""
-            INSERT INTO trip_settlement_details (
-                settlement_id, family_id, family_name, members_count, total_spent, due_amount, balance
+            WITH s AS (
+                INSERT INTO trip_settlements (
+                    trip_id, mode, period_start, period_end, total_expense, per_head_cost
+                )
+                VALUES (%s, %s, %s, %s, %s, %s)
+                RETURNING id
+            ), d AS (
+                INSERT INTO trip_settlement_details (
+                    settlement_id, family_id, family_name, members_count, total_spent, due_amount, balance
+                )
+                SELECT s.id, v.family_id, v.family_name, v.members_count,
+                       v.total_spent, v.due_amount, v.balance
+                FROM s, json_to_recordset(%s::json) AS v (
+                    family_id INTEGER, family_name TEXT, members_count INTEGER,
+                    total_spent NUMERIC, due_amount NUMERIC, balance NUMERIC
+                )
             )
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            SELECT id FROM s
         """, (
-            settlement_id,
-            fam.get("family_id"),
-            fam.get("family_name"),
-            fam.get("members_count"),
-            fam.get("total_spent"),
-            fam.get("raw_balance", 0.0),  # raw_balance acts as due_amount here
-            fam.get("balance", 0.0)
+            trip_id,
+            result.get("mode", "TRIP"),
+            result.get("period_start", today),
+            result.get("period_end", today),
+            result.get("total_expense", 0.0),
+            result.get("per_head_cost", 0.0),
+            json.dumps(details),
         ))
+        settlement_id = cursor.fetchone()[0]
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+        conn.commit()
+        cursor.close()
 
-    print(f"✅ Trip settlement {settlement_id} recorded for trip {trip_id}")
+    log.info("✅ Trip settlement %s recorded for trip %s", settlement_id, trip_id)
     return settlement_id
 
 
@@ -779,52 +878,12 @@ def record_carry_forward_log(prev_settlement_id, new_settlement_id, trip_id, cur
     - If no previous: baseline entries from 'new' with prev=0
     - If previous: delta = new.adjusted - prev.adjusted (fallback to balance)
     - Idempotent for (trip_id, new_settlement_id)
+    One INSERT ... SELECT covers both cases: with no previous settlement the
+    LEFT JOIN matches nothing, so previous_balance = 0 and delta = new balance.
     """
-    # skip if already logged
-    cursor.execute(
-        """
-        SELECT COUNT(*) FROM stay_carry_forward_log
-        WHERE trip_id = %s AND new_settlement_id = %s;
-        """,
-        (trip_id, new_settlement_id),
-    )
-    if cursor.fetchone()[0] > 0:
-        print(
-            f"⚠️ [DEBUG] Carry-forward log already exists for trip {trip_id}, settlement {new_settlement_id} — skipping."
-        )
-        return
-
-    # first settlement → baseline
-    if not prev_settlement_id:
-        print(
-            f"🧾 [DEBUG] Trip {trip_id}: Creating baseline carry-forward log (first settlement, ID={new_settlement_id})"
-        )
-        cursor.execute(
-            """
-            INSERT INTO stay_carry_forward_log (
-                trip_id, previous_settlement_id, new_settlement_id,
-                family_id, previous_balance, new_balance, delta, created_at
-            )
-            SELECT
-                %s, NULL, %s,
-                ssd.family_id,
-                0.0,
-                COALESCE(ssd.adjusted_balance, ssd.balance, 0.0),
-                COALESCE(ssd.adjusted_balance, ssd.balance, 0.0),
-                NOW()
-            FROM stay_settlement_details ssd
-            WHERE ssd.settlement_id = %s;
-            """,
-            (trip_id, new_settlement_id, new_settlement_id),
-        )
-        print(
-            f"✅ [DEBUG] Baseline carry-forward log created — {cursor.rowcount} rows inserted."
-        )
-        return
-
-    # normal prev → new
-    print(
-        f"🧾 [DEBUG] Recording carry-forward log for trip {trip_id} (prev={prev_settlement_id}, new={new_settlement_id})"
+    log.debug(
+        "🧾 Recording carry-forward log for trip %s (prev=%s, new=%s)",
+        trip_id, prev_settlement_id, new_settlement_id,
     )
     cursor.execute(
         """
@@ -844,19 +903,22 @@ def record_carry_forward_log(prev_settlement_id, new_settlement_id, trip_id, cur
         LEFT JOIN stay_settlement_details prevd
           ON prevd.family_id = newd.family_id
          AND prevd.settlement_id = %s
-        WHERE newd.settlement_id = %s;
+        WHERE newd.settlement_id = %s
+          AND NOT EXISTS (                      -- skip if already logged
+              SELECT 1 FROM stay_carry_forward_log
+              WHERE trip_id = %s AND new_settlement_id = %s
+          );
         """,
-        (trip_id, prev_settlement_id, new_settlement_id, prev_settlement_id, new_settlement_id),
+        (
+            trip_id, prev_settlement_id or None, new_settlement_id,
+            prev_settlement_id or None, new_settlement_id,
+            trip_id, new_settlement_id,
+        ),
     )
-    print(
-        f"✅ [DEBUG] Carry-forward log recorded successfully — {cursor.rowcount} rows inserted into stay_carry_forward_log."
+    log.info(
+        "✅ Carry-forward log recorded — %d rows inserted into stay_carry_forward_log.",
+        cursor.rowcount,
     )
-# ==========================================
-# Stay Settlement → History Snapshot Writer
-# ==========================================
-import json
-from decimal import Decimal
-from datetime import datetime, date
 
 # ==========================================
 # Stay Settlement → History Snapshot Writer (Decimal + Datetime safe)
@@ -869,14 +931,21 @@ def record_settlement_snapshot(
     result_data: dict,
     carry_forward_map: dict,
     finalized_by: str = None,
+    cursor=None,
 ):
     """
     Inserts a snapshot of each finalized stay settlement into stay_settlement_history.
     Includes full metadata such as period, trip type, finalized user, and delta summary.
+    With a cursor, runs inside the caller's transaction under a savepoint, so a
+    failed snapshot never aborts the settlement it describes.
     """
 
-    conn = get_connection()
-    cursor = conn.cursor()
+    own_conn = cursor is None
+    if own_conn:
+        conn = get_connection()
+        cursor = float_cursor(conn.cursor())
+    else:
+        cursor.execute("SAVEPOINT settlement_snapshot;")
 
     def _convert(obj):
         """Recursively converts Decimal → float and datetime/date → str for JSON serialization."""
@@ -900,10 +969,12 @@ def record_settlement_snapshot(
             (trip_id, new_settlement_id),
         )
         if cursor.fetchone():
-            print(
-                f"⚠️ [DEBUG] Settlement history already recorded for trip {trip_id}, settlement {new_settlement_id} — skipping."
+            log.debug(
+                "⚠️ Settlement history already recorded for trip %s, settlement %s — skipping.",
+                trip_id, new_settlement_id,
             )
-            conn.close()
+            if not own_conn:
+                cursor.execute("RELEASE SAVEPOINT settlement_snapshot;")
             return
 
         # ============================
@@ -927,7 +998,7 @@ def record_settlement_snapshot(
                 """,
                 (prev_settlement_id,),
             )
-            prev_balances = {r[0]: float(r[1] or 0.0) for r in cursor.fetchall()}
+            prev_balances = {r[0]: r[1] or 0.0 for r in cursor.fetchall()}
         else:
             prev_balances = {}
 
@@ -937,8 +1008,8 @@ def record_settlement_snapshot(
                 {
                     "family_id": fid,
                     "previous_balance": old_bal,
-                    "new_balance": float(new_bal),
-                    "delta": round(float(new_bal) - old_bal, 2),
+                    "new_balance": new_bal,
+                    "delta": round(new_bal - old_bal, 2),
                 }
             )
 
@@ -990,9 +1061,9 @@ def record_settlement_snapshot(
                 trip_type,
                 period_start,
                 period_end,
-                float(result_data.get("total_expense", 0)),
+                result_data.get("total_expense", 0),
                 int(result_data.get("total_members", 0)),
-                float(result_data.get("per_head_cost", 0.0)),
+                result_data.get("per_head_cost", 0.0),
                 finalized_by,
                 json.dumps(family_summary),
                 json.dumps(suggested_settlements),
@@ -1002,13 +1073,21 @@ def record_settlement_snapshot(
             ),
         )
 
-        conn.commit()
-        print(f"✅ Stay settlement snapshot (metadata) saved for trip {trip_id} (settlement_id={new_settlement_id})")
+        if own_conn:
+            conn.commit()
+        else:
+            cursor.execute("RELEASE SAVEPOINT settlement_snapshot;")
+        log.debug(
+            "✅ Stay settlement snapshot (metadata) saved for trip %s (settlement_id=%s)",
+            trip_id, new_settlement_id,
+        )
 
     except Exception as e:
-        conn.rollback()
-        import traceback
-        print(f"❌ Error while recording stay settlement snapshot: {e}")
-        traceback.print_exc()
+        if own_conn:
+            conn.rollback()
+        else:
+            cursor.execute("ROLLBACK TO SAVEPOINT settlement_snapshot;")
+        log.exception("❌ Error while recording stay settlement snapshot: %s", e)
     finally:
-        conn.close()
+        if own_conn:
+            put_connection(conn)